@@ -84,12 +84,17 @@ def load_pipeline(yaml_path: str):
             raise ValueError(f"Operator class {operator_type} not found in steps or custom_operators")
 
         task_config_filtered = {key: value for key, value in task_config.items() if key != "type"}
-        op = operator_class(task_id=task_id, dag=dag, **task_config_filtered)
+        if task_config_filtered.get("shards") and hasattr(operator_class, "expand_shards"):
+            # split -> one mapped task instance per shard -> reduce
+            first_op, op = operator_class.expand_shards(task_id=task_id, dag=dag, **task_config_filtered)
+        else:
+            op = operator_class(task_id=task_id, dag=dag, **task_config_filtered)
+            first_op = op
         tasks[task_id] = op
 
         # Set task dependencies
         if previous_task:
-            previous_task >> op
+            previous_task >> first_op
         previous_task = op
 
     return dag
@@ -1,7 +1,14 @@
 import logging
 from airflow.models import BaseOperator
+from utils import MessageQueue
 
 class CSVCollectorOperator(BaseOperator):
+    """
+    Appends its input to a message queue. Inside a CSVIteratorOperator row the item is kept in the row's
+    XComs, and the iterator appends the rows to the queue in row order; on its own the item is appended
+    to the queue log of the run, and XCom only holds the queue handle.
+    """
+
     def __init__(self, message_queue, **kwargs):
         super().__init__(**kwargs)
         self.message_queue = message_queue
@@ -12,11 +19,14 @@ class CSVCollectorOperator(BaseOperator):
         if input_data:
             self.logger.debug(f"One input data received: {input_data}")
             self.logger.info(f"Task id: {self.task_id}")
-            result = context['ti'].xcom_pull(task_ids=None, key=f"{self.message_queue}")
-            if not result:
-                result = []
-            result.append(input_data)
-            context["ti"].xcom_push(key=f"{self.message_queue}", value=result)
+            if "row_number" in context:
+                result = context['ti'].xcom_pull(task_ids=None, key=f"{self.message_queue}") or []
+                result.append(input_data)
+                context["ti"].xcom_push(key=f"{self.message_queue}", value=result)
+            else:
+                queue = MessageQueue.for_run(self.message_queue, context["run_id"])
+                queue.append(input_data)
+                context["ti"].xcom_push(key=f"{self.message_queue}", value=queue.handle())
             return {"message_queue": self.message_queue}
         else:
             self.logger.info("input data is None")
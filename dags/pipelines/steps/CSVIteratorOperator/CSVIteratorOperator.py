@@ -1,84 +1,185 @@
-import csv
+import os
+import json
 import logging
-import importlib
-import os.path
+import multiprocessing
+from functools import partial
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterator, Iterable
 
 from airflow.models import BaseOperator
-
-
-def get_step_names(context):
-    current_step = context['task']
-    previous_steps = [task for task in context['task'].upstream_list]
-    return {
-        "current_step": current_step,
-        "previous_steps": previous_steps
-    }
+from utils import MessageQueue
+from .row_runner import SubPipeline, init_worker, run_row_in_worker
+from .csv_input import get_input_csv_path, iter_csv_rows
+from .checkpoint import RowCheckpoint
+from .sharding import CSVShardOperator, CSVShardReduceOperator
 
 
 class CSVIteratorOperator(BaseOperator):
-    def __init__(self, tasks: dict, output_trace: str = "csv_row", **kwargs):
+    def __init__(self, tasks: dict, output_trace: str = "csv_row", max_workers: int = 1, executor: str = "thread",
+                 allow_failed_rows: bool = False, checkpoint_dir: str | None = None, shard: str | None = None,
+                 first_row: int = 1, **kwargs):
         super().__init__(**kwargs)
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'")
         self.tasks = tasks
         self.output_trace = output_trace
+        # rows processed at the same time, in a pool of threads or processes
+        self.max_workers = max_workers
+        self.executor = executor
+        # log failed rows and return the rest instead of failing the task
+        self.allow_failed_rows = allow_failed_rows
+        # finished rows are saved here and skipped by retries and re-runs while their outputs exist
+        self.checkpoint_dir = checkpoint_dir
+        # set on the mapped instances of a sharded iterator: their CSV shard and its first row number
+        self.shard = shard
+        self.first_row = first_row
         self.logger = logging.getLogger(__name__)
 
-    def execute(self, context):
-        step_names = get_step_names(context)
-        previous_task = step_names["previous_steps"][-1] if step_names["previous_steps"] else None
-        if previous_task:
-            self.logger.info(f"Previous task ID: {previous_task.task_id}")
-            previous_task_xcom_data = context['ti'].xcom_pull(task_ids=previous_task.task_id)
-            self.logger.debug(f"XCom data from previous task: {previous_task_xcom_data}")
-        else:
-            raise Exception("No previous task found, starting from the beginning.")
+    @classmethod
+    def expand_shards(cls, task_id: str, dag, shards: int, shard_dir: str = "/tmp", **kwargs):
+        """
+        Tasks of a sharded iterator: a split of the CSV into `shards` files, one mapped instance of this
+        operator per shard, which Celery runs on any free worker, and a reduce feeding the message queues.
+        Returns the first and the last task, for the loader to chain.
+        """
+        split = CSVShardOperator(task_id=f"{task_id}_split", dag=dag, shards=shards, shard_dir=shard_dir)
+        mapped = cls.partial(task_id=task_id, dag=dag, **kwargs).expand_kwargs(split.output)
+        reduce = CSVShardReduceOperator(task_id=f"{task_id}_reduce", dag=dag, mapped_task_id=task_id)
+        split >> mapped >> reduce
+        return split, reduce
 
-        try:
-            csv_data = None
-            if previous_task.output_store in previous_task_xcom_data.keys():
-                self.logger.info(f"Loaded CSV data from file path in '{previous_task.output_store}'.")
-                csv_data_path = previous_task_xcom_data.get(previous_task.output_store, None)
-                if not csv_data_path or not isinstance(csv_data_path, str) or not os.path.isfile(csv_data_path):
-                    raise ValueError(f"No file path found in XCom with key: {previous_task.output_store}")
-                with open(csv_data_path, 'r') as file:
-                    csv_data = file.read()
-            else:
-                raise Exception(f"Neither 'result' nor '{previous_task.output_store}' found in XCom data from previous task.")
+    def iter_row_results(self, rows: Iterable[tuple[int, dict]], context,
+                         checkpoint: RowCheckpoint = None) -> Iterator[dict]:
+        """
+        Results of the rows in row order, with at most a few rows per worker submitted ahead.
+        Rows with a valid checkpoint are not run again.
+        """
+        if self.max_workers <= 1:
+            plan = SubPipeline(self.tasks)
+            for row_number, row in rows:
+                result = checkpoint.get(row_number, row) if checkpoint else None
+                yield result or plan.run(row_number, row, context)
+            return
 
-            if not csv_data:
-                raise ValueError(
-                    f"No CSV data found in XCom with key: {previous_task.output_trace}")
+        executor = self.executor
+        if executor == "process" and multiprocessing.current_process().daemon:
+            self.logger.warning("Daemon processes cannot start workers, running rows in threads")
+            executor = "thread"
+        if executor == "process":
+            # every worker compiles the plan once
+            pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                       initargs=(self.tasks,))
+            run = run_row_in_worker
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.task_id)
+            plan = SubPipeline(self.tasks)
+            run = partial(plan.run, context=context)
+        self.logger.info(f"Running rows in {self.max_workers} {executor}s")
+
+        with pool:
+            pending = deque()
+            for row_number, row in rows:
+                result = checkpoint.get(row_number, row) if checkpoint else None
+                if result:
+                    # keeps its place in the row order
+                    future = Future()
+                    future.set_result(result)
+                    pending.append(future)
+                else:
+                    pending.append(pool.submit(run, row_number, row))
+                if len(pending) >= 2 * self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
-            reader = csv.DictReader(csv_data.splitlines())
-            final_result: list = []
-            for row_number, row in enumerate(reader, start=1):
-                self.logger.info(f"Iterating: row {row_number}: {row}")
-                context['ti'].xcom_push(key=f"{self.output_trace}_{row_number}", value=row)
-                self.logger.info(f"Row {row_number} pushed to XCom with key: {self.output_trace}_{row_number}")
+    def get_manifest_path(self) -> str:
+        if self.shard:
+            return f"{os.path.splitext(self.shard)[0]}_{self.output_trace}.jsonl"
+        return f"/tmp/{self.task_id}_{self.output_trace}.jsonl"
 
-                # Process sub-tasks dynamically
-                previous_output = row  # Start with the current row as input
-                context["ti"].xcom_push(key=f"previous_output", value=previous_output)
-                for task_id, task_config in self.tasks.items():
-                    unique_task_id = f"{task_id}_row_{row_number}"  # Ensure unique task ID
-                    operator_type = task_config["type"]
-                    operator_module = importlib.import_module(operator_type)
-                    operator_class = getattr(operator_module, operator_type)
+    def record_row_result(self, manifest, result: dict, queues: dict, run_id: str) -> None:
+        """
+        Write a row, its final output or error to the manifest, instead of pushing them to XCom.
+        Lists the sub-tasks left in the row context, such as a collector's message queue, are appended
+        to the queue log of the run.
+        """
+        manifest.write(json.dumps({key: result.get(key) for key in ("row_number", "row", "output", "error")}) + "\n")
+        for key, value in result["xcoms"].items():
+            if key != "previous_output" and isinstance(value, list):
+                if key not in queues:
+                    # started afresh, a retry appends all rows again
+                    queues[key] = MessageQueue.for_run(key, run_id, f"_{self.first_row}" if self.shard else "",
+                                                       truncate=True)
+                queues[key].extend(value)
 
-                    task_config_filtered = {key: value for key, value in task_config.items() if key != "type"}
-                    sub_task = operator_class(task_id=unique_task_id,
-                                              dag=context['dag'],
-                                              **task_config_filtered)
+    def execute(self, context):
+        try:
+            if self.shard:
+                self.logger.info(f"Processing shard {self.shard} from row {self.first_row}")
+                csv_data_path = self.shard
+            else:
+                csv_data_path = get_input_csv_path(context, self.logger)
+            if not os.path.getsize(csv_data_path):
+                raise ValueError(f"No CSV data found in {csv_data_path}")
 
-                    self.logger.info(f"Executing sub-task: {unique_task_id}")
-                    previous_output = sub_task.execute(context)
-                    context['ti'].xcom_push(key=f"previous_output", value=previous_output)
+            rows = iter_csv_rows(csv_data_path, self.first_row)
+            manifest_path = self.get_manifest_path()
+            row_count = 0
+            failed_rows: list = []
+            queues: dict = {}
+            # counters sub-tasks keep per row in their "stats" XCom, such as result cache hits
+            stats: dict = {}
+            checkpoint = None
+            finished = False
+            if self.checkpoint_dir:
+                checkpoint = RowCheckpoint(self.checkpoint_dir, f"{self.dag_id}_{self.task_id}", self.tasks,
+                                           f"_{self.first_row}" if self.shard else "")
+            try:
+                # Process sub-tasks dynamically, each row with its own in-memory context
+                with open(manifest_path, "w", encoding="utf-8") as manifest:
+                    for result in self.iter_row_results(rows, context, checkpoint):
+                        row_number = result["row_number"]
+                        row_count += 1
+                        self.logger.info(f"Iterated: row {row_number}: {result['row']}"
+                                         f"{' (checkpointed)' if result.get('checkpointed') else ''}")
+                        self.record_row_result(manifest, result, queues, context["run_id"])
+                        if not result.get("checkpointed"):
+                            for counter, value in (result["xcoms"].get("stats") or {}).items():
+                                stats[counter] = stats.get(counter, 0) + value
+                        if checkpoint:
+                            checkpoint.add(result)
+                        if result["error"] is not None:
+                            self.logger.error(f"Row {row_number} failed: {result['error']}\n{result['traceback']}")
+                            failed_rows.append(row_number)
+                finished = True
+            finally:
+                if checkpoint:
+                    # a pass cut short keeps all checkpoints, for the retry
+                    checkpoint.close(compact=finished)
+                    self.logger.info(f"{checkpoint.hits} rows reused from checkpoints in {checkpoint.path}")
+                if stats:
+                    self.logger.info(f"Row stats: {stats}")
+                # the rows that did finish are kept, also when the task fails;
+                # a shard leaves its queues to the reduce task
+                if not self.shard:
+                    for key, queue in queues.items():
+                        context["ti"].xcom_push(key=key, value=queue.handle())
 
-                # Push final result to XCom
-                context['ti'].xcom_push(key=f"{self.output_trace}_final_{row_number}", value=previous_output)
-                final_result.append(previous_output)
-                self.logger.info(
-                    f"Final result for row {row_number} pushed to XCom with key: {self.output_trace}_final_{row_number}")
-            return final_result
+            if failed_rows:
+                message = f"{len(failed_rows)} rows failed: {failed_rows}"
+                if not self.allow_failed_rows:
+                    raise Exception(message)
+                self.logger.warning(message)
+            # a compact summary goes to XCom, the row outputs stay in the manifest
+            summary = {"rows": row_count, "succeeded": row_count - len(failed_rows), "failed": failed_rows,
+                       "manifest": manifest_path}
+            self.logger.info(f"Processed {row_count} rows, row outputs written to {manifest_path}")
+            if stats:
+                summary["stats"] = stats
+            if self.shard:
+                summary["queues"] = {key: queue.handle() for key, queue in queues.items()}
+            return summary
         except Exception as e:
             self.logger.error(f"Error processing CSV file: {e}")
             raise
@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def output_paths(value) -> set[str]:
+    """Absolute file paths an output refers to"""
+    if isinstance(value, dict):
+        return set().union(*(output_paths(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(output_paths(item) for item in value))
+    if isinstance(value, str) and value.startswith("/") and "\n" not in value:
+        return {value}
+    return set()
+
+
+def file_hash(path: str) -> str | None:
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def referenced_files(value) -> set[str]:
+    """URLs and local files a sub-task config refers to, such as stylesheets, fields files and queries"""
+    if isinstance(value, dict):
+        return set().union(*(referenced_files(item) for item in value.values()))
+    if isinstance(value, list):
+        return set().union(*(referenced_files(item) for item in value))
+    if isinstance(value, str) and (value.startswith("http://") or value.startswith("https://")
+                                   or os.path.isfile(value)):
+        return {value}
+    return set()
+
+
+def content_hash(location: str) -> str:
+    if os.path.isfile(location):
+        return file_hash(location)
+    response = httpx.get(location, follow_redirects=True)
+    response.raise_for_status()
+    return hashlib.sha256(response.content).hexdigest()
+
+
+def config_hash(tasks: dict) -> str:
+    """
+    Hash of the sub-pipeline config and the contents of the files it refers to, so a changed stylesheet,
+    fields file or query invalidates the rows it produced
+    """
+    digest = hashlib.sha256(json.dumps(tasks, sort_keys=True).encode())
+    for location in sorted(referenced_files(tasks)):
+        try:
+            digest.update(f"{location}:{content_hash(location)}".encode())
+        except (OSError, httpx.HTTPError) as e:
+            # not knowing whether it changed, no row of an earlier run is reused
+            logger.warning(f"Could not read {location} for the checkpoint key, not reusing checkpoints: {e}")
+            digest.update(os.urandom(16))
+    return digest.hexdigest()
+
+
+class RowCheckpoint:
+    """
+    Results of finished rows, appended to JSONL files in a directory per iterator task, so a retry or a
+    re-run only processes rows that failed, changed, or whose output files were removed or overwritten.
+    Rows are keyed by a hash of their content, the sub-pipeline config and the files it refers to, and the
+    hashes of their output files are kept with them: sub-tasks write to paths named after the row number,
+    which later runs reuse. After a complete pass the file is rewritten with the rows of that pass only.
+    """
+
+    def __init__(self, checkpoint_dir: str, name: str, tasks: dict, shard: str = ""):
+        task_dir = os.path.join(checkpoint_dir, name)
+        os.makedirs(task_dir, exist_ok=True)
+        self.config_hash = config_hash(tasks)
+        # shards of a mapped iterator each append to their own file, and read those of all shards
+        self.path = os.path.join(task_dir, f"rows{shard}.jsonl")
+        self.entries = {}
+        # rows reused or added by this pass
+        self.live = {}
+        for file_name in sorted(os.listdir(task_dir)):
+            if not re.fullmatch(r"rows(_\d+)?\.jsonl", file_name):
+                continue
+            with open(os.path.join(task_dir, file_name), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by a killed task
+                        continue
+                    self.entries[entry["key"]] = entry
+        logger.info(f"Loaded {len(self.entries)} row checkpoints for {name}")
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.hits = 0
+
+    def __enter__(self) -> "RowCheckpoint":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self, compact: bool = False) -> None:
+        """Close the file; after a pass over all rows, compact it to the rows of that pass"""
+        if self.file.closed:
+            return
+        self.file.close()
+        if compact:
+            tmp_path = f"{self.path}.{os.getpid()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in self.live.values())
+            os.replace(tmp_path, self.path)
+            logger.info(f"Compacted {self.path} to {len(self.live)} rows")
+
+    def key(self, row: dict) -> str:
+        return hashlib.sha256(f"{self.config_hash}:{json.dumps(row, sort_keys=True)}".encode()).hexdigest()
+
+    def get(self, row_number: int, row: dict) -> dict | None:
+        """The saved result of the row, if its outputs are still valid"""
+        entry = self.entries.get(self.key(row))
+        # sub-task output files are named after the row number, another position means another row's files
+        if entry is None or entry["row_number"] != row_number:
+            return None
+        files = entry.get("files")
+        if files is None or any(file_hash(path) != digest for path, digest in files.items()):
+            logger.info(f"Output files of row {row_number} are gone or were overwritten, processing it again")
+            return None
+        self.hits += 1
+        self.live[entry["key"]] = entry
+        return {"row_number": row_number, "row": row, "output": entry["output"], "xcoms": entry["xcoms"],
+                "error": None, "checkpointed": True}
+
+    def add(self, result: dict) -> None:
+        if result["error"] is not None or result.get("checkpointed"):
+            return
+        xcoms = {key: value for key, value in result["xcoms"].items() if key != "previous_output"}
+        files = {path: file_hash(path) for path in sorted(output_paths(result["output"]) | output_paths(xcoms))}
+        entry = {"key": self.key(result["row"]), "row_number": result["row_number"], "output": result["output"],
+                 "xcoms": xcoms, "files": files}
+        self.live[entry["key"]] = entry
+        self.file.write(json.dumps(entry) + "\n")
+        # flushed per row, so a killed task keeps the rows it finished
+        self.file.flush()
@@ -0,0 +1,13 @@
+import csv
+from typing import Iterator
+
+from utils import get_input_csv_path
+
+
+def iter_csv_rows(csv_path: str, first_row: int = 1) -> Iterator[tuple[int, dict]]:
+    """
+    Numbered rows of a CSV file, parsed straight from the buffered file handle, so memory does not grow
+    with the file and the first row is ready before the rest is read. Quoted fields may hold newlines.
+    """
+    with open(csv_path, "r", newline="", encoding="utf-8") as file:
+        yield from enumerate(csv.DictReader(file), start=first_row)
@@ -0,0 +1,111 @@
+import json
+import logging
+import importlib
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class RowTaskInstance:
+    """
+    Stands in for the TaskInstance in the context of a row's sub-tasks.
+    XComs are kept per row in memory, serialized as Airflow would, so rows running at the same time
+    cannot read each other's `previous_output`.
+    """
+
+    def __init__(self, row_number: int):
+        self.row_number = row_number
+        self.xcoms = {}
+
+    def xcom_push(self, key: str, value, **kwargs) -> None:
+        self.xcoms[key] = json.loads(json.dumps(value))
+
+    def xcom_pull(self, task_ids=None, key: str = "return_value", **kwargs):
+        return self.xcoms.get(key)
+
+
+class RowState:
+    """Per-row state handed from step to step: the row, its XComs and the context the sub-tasks see"""
+
+    def __init__(self, row_number: int, row: dict, context: dict = None):
+        self.row_number = row_number
+        self.row = row
+        self.ti = RowTaskInstance(row_number)
+        context = context or {}
+        self.context = {
+            "ti": self.ti,
+            "task_instance": self.ti,
+            "row_number": row_number,
+            "dag": context.get("dag"),
+            "task": context.get("task"),
+            "params": context.get("params", {}),
+            "run_id": context.get("run_id"),
+        }
+
+    def result(self, error: Exception = None) -> dict:
+        result = {"row_number": self.row_number, "row": self.row, "xcoms": self.ti.xcoms, "error": None,
+                  "output": self.ti.xcom_pull(key="previous_output")}
+        if error is not None:
+            result.update(output=None, error=f"{type(error).__name__}: {error}", traceback=traceback.format_exc())
+        return result
+
+
+class Step:
+    """
+    A sub-task resolved once: its operator class and a template operator built from its config.
+    Each row runs a shallow copy of the template with the row's task ID, so attributes an operator
+    sets while running stay with that row, and no operator is added to the DAG.
+    """
+
+    def __init__(self, task_id: str, task_config: dict):
+        operator_type = task_config["type"]
+        operator_module = importlib.import_module(operator_type)
+        self.operator_class = getattr(operator_module, operator_type)
+        self.task_id = task_id
+        task_config_filtered = {key: value for key, value in task_config.items() if key != "type"}
+        self.template = self.operator_class(task_id=task_id, **task_config_filtered)
+
+    def bind(self, row_number: int):
+        operator = object.__new__(self.operator_class)
+        operator.__dict__.update(self.template.__dict__)
+        operator.task_id = f"{self.task_id}_row_{row_number}"  # Ensure unique task ID
+        return operator
+
+    def __call__(self, state: RowState):
+        operator = self.bind(state.row_number)
+        logger.info(f"Executing sub-task: {operator.task_id}")
+        output = operator.execute(state.context)
+        state.ti.xcom_push(key="previous_output", value=output)
+        return output
+
+
+class SubPipeline:
+    """Execution plan of the nested tasks of a CSVIteratorOperator, compiled once and run for every row"""
+
+    def __init__(self, tasks: dict):
+        self.steps = [Step(task_id, task_config) for task_id, task_config in tasks.items()]
+
+    def run(self, row_number: int, row: dict, context: dict = None) -> dict:
+        """Run the steps on one row and return its final output and XComs, or the error it failed with"""
+        state = RowState(row_number, row, context)
+        try:
+            state.ti.xcom_push(key="previous_output", value=row)  # Start with the current row as input
+            for step in self.steps:
+                step(state)
+            return state.result()
+        except Exception as e:
+            return state.result(e)
+
+
+# plan of a worker process, compiled once when the process starts
+worker_plan: SubPipeline | None = None
+
+
+def init_worker(tasks: dict) -> None:
+    global worker_plan
+    worker_plan = SubPipeline(tasks)
+
+
+def run_row_in_worker(row_number: int, row: dict) -> dict:
+    # the Airflow context does not cross processes, sub-tasks get a row context without the DAG
+    return worker_plan.run(row_number, row)
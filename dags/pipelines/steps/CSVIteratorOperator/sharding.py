@@ -0,0 +1,95 @@
+import os
+import csv
+import math
+import shutil
+import logging
+
+from airflow.models import BaseOperator
+from utils import MessageQueue
+from .csv_input import get_input_csv_path
+
+
+class CSVShardOperator(BaseOperator):
+    """
+    Splits the CSV of the previous task into `shards` files of consecutive rows, each with the header,
+    and returns the keyword arguments of the mapped CSVIteratorOperator instance for every shard.
+    The shard files go to a directory every worker can read (/tmp is a shared volume in the compose stack).
+    """
+
+    def __init__(self, shards: int, shard_dir: str = "/tmp", **kwargs):
+        super().__init__(**kwargs)
+        self.shards = shards
+        self.shard_dir = shard_dir
+        self.logger = logging.getLogger(__name__)
+
+    def execute(self, context):
+        csv_path = get_input_csv_path(context, self.logger)
+        # count records, not lines, since quoted fields may hold newlines
+        with open(csv_path, "r", newline="", encoding="utf-8") as f:
+            row_count = max(0, sum(1 for _ in csv.reader(f)) - 1)
+        if not row_count:
+            raise ValueError(f"No CSV rows found in {csv_path}")
+        rows_per_shard = math.ceil(row_count / max(1, self.shards))
+
+        shard_dir = os.path.join(self.shard_dir, f"{self.task_id}_{context['run_id']}".replace(":", "_"))
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.makedirs(shard_dir)
+        shards = []
+        with open(csv_path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            writer, shard_file = None, None
+            for row_number, row in enumerate(reader, start=1):
+                if (row_number - 1) % rows_per_shard == 0:
+                    if shard_file:
+                        shard_file.close()
+                    shard_path = os.path.join(shard_dir, f"shard_{len(shards):04d}.csv")
+                    shard_file = open(shard_path, "w", newline="", encoding="utf-8")
+                    writer = csv.writer(shard_file)
+                    writer.writerow(header)
+                    shards.append({"shard": shard_path, "first_row": row_number})
+                writer.writerow(row)
+            if shard_file:
+                shard_file.close()
+        self.logger.info(f"Split {row_count} rows of {csv_path} into {len(shards)} shards in {shard_dir}")
+        return shards
+
+
+class CSVShardReduceOperator(BaseOperator):
+    """
+    Joins the results of the mapped CSVIteratorOperator instances in shard order: the queue logs of the
+    shards are read one after the other through one handle per message queue, pushed to XCom as an
+    unsharded iterator would, and the shard summaries become one summary.
+    """
+
+    def __init__(self, mapped_task_id: str, **kwargs):
+        super().__init__(**kwargs)
+        self.mapped_task_id = mapped_task_id
+        self.logger = logging.getLogger(__name__)
+
+    def execute(self, context):
+        shard_results = context["ti"].xcom_pull(task_ids=self.mapped_task_id) or []
+        summary = {"rows": 0, "succeeded": 0, "failed": [], "manifests": []}
+        queues: dict = {}
+        stats: dict = {}
+        for shard_number, shard_result in enumerate(shard_results):
+            if not shard_result:
+                self.logger.warning(f"No result from shard {shard_number}")
+                continue
+            summary["rows"] += shard_result["rows"]
+            summary["succeeded"] += shard_result["succeeded"]
+            summary["failed"].extend(shard_result["failed"])
+            summary["manifests"].append(shard_result["manifest"])
+            for counter, value in shard_result.get("stats", {}).items():
+                stats[counter] = stats.get(counter, 0) + value
+            for key, handle in shard_result["queues"].items():
+                queues.setdefault(key, MessageQueue(key, [])).paths.extend(handle["paths"])
+
+        for key, queue in queues.items():
+            context["ti"].xcom_push(key=key, value=queue.handle())
+            self.logger.info(f"Pushed message queue '{key}' of {len(queue.paths)} shard logs")
+        if stats:
+            summary["stats"] = stats
+            self.logger.info(f"Row stats: {stats}")
+        self.logger.info(f"Reduced {summary['rows']} rows from {len(shard_results)} shards")
+        return summary
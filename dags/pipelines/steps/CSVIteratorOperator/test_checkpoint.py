@@ -0,0 +1,60 @@
+from CSVIteratorOperator.checkpoint import RowCheckpoint
+
+
+def run_row(checkpoint_dir, tasks, row, output_path, content, name="dag_csv_iterator", compact=True):
+    """One pass over a single row: reuse its checkpoint or write its output; True if it was reused"""
+    checkpoint = RowCheckpoint(str(checkpoint_dir), name, tasks)
+    result = checkpoint.get(1, row)
+    if result is None:
+        output_path.write_text(content)
+        checkpoint.add({"row_number": 1, "row": row, "output": {"ttl": str(output_path)}, "xcoms": {},
+                        "error": None})
+    checkpoint.close(compact=compact)
+    return result is not None
+
+
+def test_unchanged_row_is_reused(tmp_path):
+    output = tmp_path / "row_1.ttl"
+    assert not run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "A")
+    assert run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "A")
+
+
+def test_overwritten_output_is_not_reused(tmp_path):
+    output = tmp_path / "row_1.ttl"
+    run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "A")
+    # another row in the same position writes the same path
+    run_row(tmp_path / "ck", {"step": {}}, {"id": "b"}, output, "B")
+    assert not run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "A")
+
+
+def test_changed_referenced_file_invalidates_rows(tmp_path):
+    stylesheet = tmp_path / "toSPARQL.xsl"
+    stylesheet.write_text("<xsl:stylesheet/>")
+    tasks = {"xslt": {"xslt_file": str(stylesheet), "xslt_params": {"lookup-uri": str(stylesheet)}}}
+    output = tmp_path / "row_1.sparql"
+    run_row(tmp_path / "ck", tasks, {"id": "a"}, output, "A")
+    assert run_row(tmp_path / "ck", tasks, {"id": "a"}, output, "A")
+    stylesheet.write_text("<xsl:stylesheet version='3.0'/>")
+    assert not run_row(tmp_path / "ck", tasks, {"id": "a"}, output, "A")
+
+
+def test_complete_pass_compacts_the_file(tmp_path):
+    output = tmp_path / "row_1.ttl"
+    for row_id in ("a", "b", "c"):
+        run_row(tmp_path / "ck", {"step": {}}, {"id": row_id}, output, row_id)
+    lines = (tmp_path / "ck" / "dag_csv_iterator" / "rows.jsonl").read_text().splitlines()
+    assert len(lines) == 1
+
+
+def test_pass_cut_short_keeps_all_rows(tmp_path):
+    output = tmp_path / "row_1.ttl"
+    run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "a")
+    run_row(tmp_path / "ck", {"step": {}}, {"id": "b"}, output, "b", compact=False)
+    lines = (tmp_path / "ck" / "dag_csv_iterator" / "rows.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+
+
+def test_other_tasks_are_not_loaded(tmp_path):
+    output = tmp_path / "row_1.ttl"
+    run_row(tmp_path / "ck", {"step": {}}, {"id": "a"}, output, "A", name="dag_csv_iterator2")
+    assert RowCheckpoint(str(tmp_path / "ck"), "dag_csv_iterator", {"step": {}}).entries == {}
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import uuid
+import pytest
+import CSVIteratorOperator.CSVIteratorOperator
+from utils import iter_message_queue
+
+iterator_module = sys.modules["CSVIteratorOperator.CSVIteratorOperator"]
+
+# a sub-task module for the row workers to import by its type, as the loader does
+ROW_OPERATOR = '''
+import os
+import time
+from airflow.models import BaseOperator
+
+
+class SlowRowOperator(BaseOperator):
+    """Later rows take less time, so they finish before the rows submitted earlier"""
+
+    def execute(self, context):
+        row = context["ti"].xcom_pull(key="previous_output")
+        time.sleep(0.05 / int(row["id"]))
+        if row["fail"]:
+            raise ValueError(f"row {row['id']} failed")
+        return {"id": row["id"], "pid": os.getpid()}
+'''
+
+TASKS = {
+    "slow": {"type": "SlowRowOperator"},
+    "collect": {"type": "CSVCollectorOperator", "message_queue": "all_the_rows"},
+}
+
+
+class TI:
+    def __init__(self):
+        self.xcoms = {}
+
+    def xcom_push(self, key, value=None, **kwargs):
+        self.xcoms[key] = value
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch):
+    (tmp_path / "SlowRowOperator.py").write_text(ROW_OPERATOR)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / "rows.csv"
+    path.write_text("id,fail\n1,\n2,\n3,yes\n4,\n5,\n6,\n")
+    monkeypatch.setattr(iterator_module, "get_input_csv_path", lambda context, logger: str(path))
+    return path
+
+
+def run_iterator(ti, **kwargs) -> tuple[dict, list]:
+    """Summary and manifest of an iterator over the CSV, which pushes its queue handles to ti"""
+    operator = iterator_module.CSVIteratorOperator(task_id=f"test_rows_{uuid.uuid4().hex}", tasks=TASKS, **kwargs)
+    try:
+        summary = operator.execute({"ti": ti, "run_id": f"test_{uuid.uuid4().hex}"})
+        with open(operator.get_manifest_path(), encoding="utf-8") as f:
+            return summary, [json.loads(line) for line in f]
+    finally:
+        os.remove(operator.get_manifest_path())
+
+
+@pytest.mark.parametrize("max_workers,executor", [(1, "thread"), (3, "thread"), (3, "process")])
+def test_rows_are_gathered_in_row_order(csv_path, max_workers, executor):
+    ti = TI()
+    summary, manifest = run_iterator(ti, max_workers=max_workers, executor=executor, allow_failed_rows=True)
+    queue = list(iter_message_queue(ti.xcoms["all_the_rows"]))
+    assert [row["row_number"] for row in manifest] == [1, 2, 3, 4, 5, 6]
+    assert [item["id"] for item in queue] == ["1", "2", "4", "5", "6"]
+    assert summary["failed"] == [3] and summary["succeeded"] == 5
+    assert "row 3 failed" in manifest[2]["error"]
+    if executor == "process":
+        assert os.getpid() not in {item["pid"] for item in queue}
+
+
+def test_failed_row_keeps_the_other_rows(csv_path):
+    ti = TI()
+    with pytest.raises(Exception, match=r"1 rows failed: \[3\]"):
+        run_iterator(ti, max_workers=3)
+    # the queue of the rows that did finish is still pushed
+    assert [item["id"] for item in iter_message_queue(ti.xcoms["all_the_rows"])] == ["1", "2", "4", "5", "6"]
@@ -0,0 +1,78 @@
+import os
+import csv
+import sys
+import uuid
+import pytest
+import CSVIteratorOperator.CSVIteratorOperator
+import CSVIteratorOperator.sharding
+from utils import iter_message_queue
+
+iterator_module = sys.modules["CSVIteratorOperator.CSVIteratorOperator"]
+sharding_module = sys.modules["CSVIteratorOperator.sharding"]
+
+TASKS = {"collect": {"type": "CSVCollectorOperator", "message_queue": "all_the_rows"}}
+
+
+class TI:
+    def __init__(self, pulled=None):
+        self.pulled = pulled
+        self.xcoms = {}
+
+    def xcom_push(self, key, value=None, **kwargs):
+        self.xcoms[key] = value
+
+    def xcom_pull(self, task_ids=None, key="return_value", **kwargs):
+        return self.pulled
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch):
+    path = tmp_path / "rows.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name"])
+        # a quoted field holding a newline is one record
+        writer.writerows([[row_id, f"place {row_id}\nline 2" if row_id == 2 else f"place {row_id}"]
+                          for row_id in range(1, 8)])
+    monkeypatch.setattr(sharding_module, "get_input_csv_path", lambda context, logger: str(path))
+    monkeypatch.setattr(iterator_module, "get_input_csv_path", lambda context, logger: str(path))
+    return path
+
+
+def run_sharded(tmp_path, shards: int) -> TI:
+    """Split, the mapped iterator instances one after the other, and the reduce; returns the reduce's TI"""
+    run_id = f"test_{uuid.uuid4().hex}"
+    split = sharding_module.CSVShardOperator(task_id="iterate_split", shards=shards, shard_dir=str(tmp_path))
+    shard_kwargs = split.execute({"ti": TI(), "run_id": run_id})
+    # later shards may finish first on other workers
+    results = {}
+    for kwargs in reversed(shard_kwargs):
+        operator = iterator_module.CSVIteratorOperator(task_id="iterate", tasks=TASKS, **kwargs)
+        results[kwargs["first_row"]] = operator.execute({"ti": TI(), "run_id": run_id})
+    ti = TI([results[kwargs["first_row"]] for kwargs in shard_kwargs])
+    summary = sharding_module.CSVShardReduceOperator(task_id="iterate_reduce", mapped_task_id="iterate").execute(
+        {"ti": ti, "run_id": run_id})
+    ti.xcoms["return_value"] = summary
+    return ti
+
+
+def test_split_keeps_the_header_and_row_numbers(tmp_path, csv_path):
+    split = sharding_module.CSVShardOperator(task_id="iterate_split", shards=3, shard_dir=str(tmp_path))
+    shard_kwargs = split.execute({"ti": TI(), "run_id": "manual__2024-01-01T00:00:00"})
+    assert [kwargs["first_row"] for kwargs in shard_kwargs] == [1, 4, 7]
+    with open(shard_kwargs[0]["shard"], newline="", encoding="utf-8") as f:
+        assert [row["name"] for row in csv.DictReader(f)] == ["place 1", "place 2\nline 2", "place 3"]
+
+
+@pytest.mark.parametrize("shards", [1, 3, 10])
+def test_reduced_queue_matches_an_unsharded_run(tmp_path, csv_path, shards):
+    unsharded = TI()
+    operator = iterator_module.CSVIteratorOperator(task_id=f"test_rows_{uuid.uuid4().hex}", tasks=TASKS)
+    operator.execute({"ti": unsharded, "run_id": f"test_{uuid.uuid4().hex}"})
+    os.remove(operator.get_manifest_path())
+
+    reduced = run_sharded(tmp_path, shards)
+    items = list(iter_message_queue(reduced.xcoms["all_the_rows"]))
+    assert items == list(iter_message_queue(unsharded.xcoms["all_the_rows"]))
+    assert [item["id"] for item in items] == [str(row_id) for row_id in range(1, 8)]
+    assert reduced.xcoms["return_value"]["rows"] == 7 and reduced.xcoms["return_value"]["failed"] == []
@@ -6,7 +6,7 @@ import pandas as pd
 from airflow.models import BaseOperator
 from rdflib import Graph, URIRef, Literal, Namespace
 from rdflib.namespace import RDF
-from utils import get_step_names
+from utils import get_step_names, MessageQueue, iter_message_queue
 
 
 def csv_to_ttl(csv_file, ttl_file, base_uri, logger):
@@ -41,12 +41,34 @@ def csv_to_ttl(csv_file, ttl_file, base_uri, logger):
 
 
 class CSVToTTLOperator(BaseOperator):
-    def __init__(self, base_uri, **kwargs):
+    def __init__(self, base_uri, batch: bool = False, message_queue: str | None = None,
+                 output_queue: str | None = None, **kwargs):
         super().__init__(**kwargs)
         self.base_uri = base_uri
+        # convert every row collected in message_queue, e.g. by a batch XSLTTransformationOperator,
+        # and queue them with their TTL file in output_queue
+        self.batch = batch
+        self.message_queue = message_queue
+        self.output_queue = output_queue
         self.logger = logging.getLogger(__name__)
 
+    def execute_batch(self, context):
+        input_data = context['ti'].xcom_pull(task_ids=None, key=self.message_queue)
+        queue = MessageQueue.for_run(self.output_queue, context["run_id"], truncate=True)
+        row_count = 0
+        for row_number, item in enumerate(iter_message_queue(input_data), start=1):
+            ttl_path = f"/tmp/{self.task_id}_row_{row_number}.ttl"
+            csv_to_ttl(item["csv"], ttl_path, self.base_uri, self.logger)
+            item["ttl"] = ttl_path
+            queue.append(item)
+            row_count += 1
+        self.logger.info(f"Converted {row_count} csv rows to ttl into message queue '{self.output_queue}'")
+        context["ti"].xcom_push(key=self.output_queue, value=queue.handle())
+        return {"rows": row_count, "message_queue": self.output_queue}
+
     def execute(self, context):
+        if self.batch:
+            return self.execute_batch(context)
         input_data = context['ti'].xcom_pull(task_ids=None, key='previous_output')
         if input_data and isinstance(input_data, dict) and "csv" in input_data:
             self.logger.info(f"Step: {self.task_id}, Converting csv row to ttl")
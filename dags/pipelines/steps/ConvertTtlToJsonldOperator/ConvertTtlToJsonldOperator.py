@@ -1,9 +1,10 @@
+import os
 import json
 import logging
 from rdflib import Graph
 from pyld import jsonld
 from airflow.models import BaseOperator
-from utils import get_step_names
+from utils import get_step_names, MessageQueue, iter_message_queue
 
 
 json_context = {
@@ -95,13 +96,21 @@ class ConvertTtlToJsonldOperator(BaseOperator):
 
         return jsonld_data
 
+    def iter_ttl_files(self, input_data):
+        """(name, path) of the TTL files to convert: a dict such as SplitGraphOperator returns, or a message queue"""
+        if isinstance(input_data, dict) and not MessageQueue.is_handle(input_data):
+            yield from input_data.items()
+            return
+        for item in iter_message_queue(input_data):
+            yield os.path.splitext(os.path.basename(item["ttl"]))[0], item["ttl"]
+
     def execute(self, context):
         input_data = context['ti'].xcom_pull(task_ids=None, key=self.message_queue)
 
         # Process each place
         counter = 0
         result = {}
-        for k, v in input_data.items():
+        for k, v in self.iter_ttl_files(input_data):
             counter += 1
             self.logger.info(f"Processing place {counter}")
             self.logger.info(f"Task id: {self.task_id}: {json.dumps(v, indent=4)}")
@@ -1,14 +1,26 @@
 import os
 import re
 import json
+import math
 import httpx
+import shutil
+import asyncio
+import multiprocessing
 import logging
 import argparse
 from rdflib import Graph
 from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
 from airflow.models import BaseOperator
-from typing import Dict, List, Any, Union, LiteralString
+from typing import Dict, List, Any, Union, LiteralString, Callable, Iterator, AsyncIterator
 from .config import config
+from .schema_index import SchemaIndex
+from .http_cache import ResponseCache, CachingTransport, AsyncCachingTransport
+from .emitter import TripleEmitter, patch_triples_file
+from .fetch_controller import FetchController
+from .spool import TableSpool, read_range, iter_batches
+from .watermarks import (load_watermarks, save_watermarks, get_watermark_field, newer_records, max_watermark,
+                         patch_graph)
 from utils import get_step_names
 
 # TODO: FIX error in adding context to JSON-LD, all the fields are missing now
@@ -22,18 +34,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# On-disk cache of API responses, revalidated with ETag / Last-Modified
+response_cache: ResponseCache | None = None
+# Retries, adaptive concurrency and latency stats of all API requests
+fetch_controller: FetchController | None = None
 # Global HTTPX client
-http_client = httpx.Client(follow_redirects=True, timeout=httpx.Timeout(10.0))
+http_client: httpx.Client | None = None
+
+
+def setup_api_clients() -> None:
+    """(Re)create the response cache, fetch controller and HTTP client from the current config"""
+    global response_cache, fetch_controller, http_client
+    response_cache = (ResponseCache(config["httpCache"]["dir"], config["httpCache"]["maxBytes"])
+                      if config["httpCache"].get("dir") else None)
+    fetch_controller = FetchController(config["api"])
+    http_client = httpx.Client(follow_redirects=True, timeout=fetch_controller.create_timeout(),
+                               transport=CachingTransport(response_cache) if response_cache else None)
+
+
+setup_api_clients()
 httpx_log = logging.getLogger("httpx")
 httpx_log.setLevel(logging.ERROR)
 
 table_map = config["context"].get("table_map", {})
+# compiled FieldPlan per (table, prefix, outgoing foreign keys)
+field_plans: Dict[tuple, "FieldPlan"] = {}
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Fetch related tables starting from a given table from Globalise API in JSON-LD and Turtle")
     parser.add_argument('-t', '--tableName', type=str, help='Name of the table', default="location")
     parser.add_argument('-d', '--distance', type=int, help='Distance from the given table', default=3)
+    parser.add_argument('-c', '--concurrency', type=int, help='Number of pages fetched in parallel',
+                        default=config["api"]["concurrency"])
+    parser.add_argument('-w', '--workers', type=int, help='Processes converting tables in parallel',
+                        default=config["workers"])
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only fetch records changed since the previous run and patch its output')
     return parser.parse_args()
 
 
@@ -63,26 +100,11 @@ def init_json_ld() -> Dict:
     }
 
 
-def add_table_fields_to_context(json_ld: Dict, table_name: str, fields: Dict, table_prefix: str = "") -> Dict:
-    context = json_ld["@context"]
-    table_name_with_prefix = f"{table_prefix}{table_name}" if table_prefix else table_name
-
-    context[table_name] = join_url(config["context"]["baseURI"], table_name_with_prefix)
-
-    for field in fields:
-        if field not in config["context"]["uniqueField"]:
-            if field in table_map.keys():
-                logger.debug(f"Mapping field {field} to {table_map[field]}")
-                # special mapping case for child_location and parent_location to location
-                if field in ["child_location", "parent_location"]:
-                    context[f"{table_name}-{field}"] = join_url(config["context"]["baseURI"], table_name_with_prefix,
-                                                                field)
-                else:
-                    context[f"{table_name}-{table_map[field]}"] = join_url(config["context"]["baseURI"],
-                                                                           table_name_with_prefix, table_map[field])
-            else:
-                context[f"{table_name}-{field}"] = join_url(config["context"]["baseURI"], table_name_with_prefix, field)
-    json_ld["@context"] = context
+def add_table_fields_to_context(json_ld: Dict, table_name: str, fields: Dict, table_prefix: str = "",
+                                field_plan: "FieldPlan" = None) -> Dict:
+    if field_plan is None:
+        field_plan = FieldPlan(table_name, table_prefix=table_prefix)
+    json_ld["@context"].update(field_plan.context_terms(fields))
     return json_ld
 
 
@@ -227,7 +249,7 @@ def save_json_ld_to_file(json_ld: Dict, file_path: LiteralString) -> None:
 
 
 def get_all_endpoints() -> Dict:
-    response = http_client.get(config["api"]["baseURL"])
+    response = fetch_controller.get(http_client, config["api"]["baseURL"])
     logger.info(f"Fetching endpoints from {config['api']['baseURL']}")
     if response.status_code != 200:
         raise Exception(f"Error fetching endpoints: {response.status_code}")
@@ -242,7 +264,7 @@ def get_all_endpoints() -> Dict:
 
 def fetch_record_by_id(table_name: str, record_id: str) -> Dict:
     url = join_url(config["api"]["baseURL"], table_name.lower(), record_id)
-    response = http_client.get(url)
+    response = fetch_controller.get(http_client, url, table_name=table_name)
     if response.status_code != 200:
         raise Exception(f"Error fetching data from {url}: {response.status_code}")
     return response.json()
@@ -252,37 +274,180 @@ def fetch_table_in_batch(table_name: str, page: int = 1, page_size: int = 1) ->
     url = join_url(config["api"]["baseURL"], table_name.lower())
     params = {"page": page, "page_size": page_size}
 
-    response = http_client.get(url, params=params)
+    response = fetch_controller.get(http_client, url, params, table_name)
     if response.status_code != 200:
         raise Exception(f"Error fetching {table_name} from {url}: {response.status_code}")
     return response.json()
 
 
-def fetch_table_rows(table_name: str) -> List:
-    data = []
+def iter_table_pages(table_name: str, params: Dict = None) -> Iterator[List]:
     next_url = join_url(config["api"]["baseURL"], table_name.lower())
 
     while next_url:
         logger.debug(f"Fetching data from: {next_url}")
-        response = http_client.get(next_url)
+        response = fetch_controller.get(http_client, next_url, params, table_name)
         if response.status_code != 200:
             raise Exception(f"Error fetching data from {next_url}: {response.status_code}")
 
         result = response.json()
-        data.extend(result.get("results", []))
+        yield result.get("results", [])
         next_url = result.get("links", {}).get("next")
+        # the next link already carries the query parameters
+        params = None
 
+
+def fetch_table_rows(table_name: str, params: Dict = None) -> List:
+    data = []
+    for page in iter_table_pages(table_name, params):
+        data.extend(page)
     return data
 
 
+def get_page_count(first_page: Dict, page_size: int) -> int | None:
+    """
+    Work out the number of pages of a table from its first page.
+    Returns None if the response carries neither a total count nor a page count.
+    """
+    for source in (first_page, first_page.get("links", {}), first_page.get("metadata", {})):
+        if not isinstance(source, dict):
+            continue
+        if source.get("total_pages") is not None:
+            return int(source["total_pages"])
+        if source.get("count") is not None and page_size > 0:
+            return math.ceil(int(source["count"]) / page_size)
+    return None
+
+
+def create_async_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(follow_redirects=True, timeout=fetch_controller.create_timeout(),
+                             transport=AsyncCachingTransport(response_cache) if response_cache else None)
+
+
+async def fetch_json_async(client: httpx.AsyncClient, url: str, params: Dict = None, table_name: str = "") -> Dict:
+    logger.debug(f"Fetching data from: {url} {params or ''}")
+    response = await fetch_controller.get_async(client, url, params, table_name)
+    if response.status_code != 200:
+        raise Exception(f"Error fetching data from {url}: {response.status_code}")
+    return response.json()
+
+
+async def iter_table_pages_async(table_name: str, client: httpx.AsyncClient, params: Dict = None,
+                                 windowed: bool = False) -> AsyncIterator[List]:
+    """
+    Pages of a table in API order, requested in parallel.
+    The page URLs are derived from the total count on the first page. When windowed, only as many
+    pages as the current concurrency limit are requested (and held) at a time.
+    """
+    url = join_url(config["api"]["baseURL"], table_name.lower())
+    page_size = config["api"]["pageSize"]
+
+    params = params or {}
+
+    first_page = await fetch_json_async(client, url, {**params, "page": 1, "page_size": page_size}, table_name)
+    results = first_page.get("results", [])
+    yield results
+    next_url = first_page.get("links", {}).get("next")
+    if not next_url:
+        return
+
+    # the API may cap the page size, so count pages with the size actually returned
+    page_count = get_page_count(first_page, len(results))
+    if page_count is None:
+        logger.warning(f"No total count for '{table_name}', fetching the remaining pages one by one")
+        while next_url:
+            result = await fetch_json_async(client, next_url, table_name=table_name)
+            yield result.get("results", [])
+            next_url = result.get("links", {}).get("next")
+        return
+
+    logger.debug(f"Fetching {page_count} pages of '{table_name}'")
+    window_start = 2
+    while window_start <= page_count:
+        window = max(1, int(fetch_controller.limit)) if windowed else page_count
+        pages = await asyncio.gather(*[
+            fetch_json_async(client, url, {**params, "page": page, "page_size": page_size}, table_name)
+            for page in range(window_start, min(window_start + window, page_count + 1))
+        ])
+        for page in pages:
+            yield page.get("results", [])
+        window_start += window
+
+
+async def fetch_table_rows_async(table_name: str, client: httpx.AsyncClient, params: Dict = None) -> List:
+    """Fetch all rows of a table, requesting the pages in parallel; records keep the API order"""
+    data = []
+    async for page in iter_table_pages_async(table_name, client, params):
+        data.extend(page)
+    return data
+
+
+async def fetch_tables_rows_async(table_names: List[str], concurrency: int,
+                                  params: Dict[str, Dict] = None) -> Dict[str, List]:
+    """Fetch the rows of several tables, starting with at most `concurrency` requests in flight"""
+    fetch_controller.start(concurrency)
+    params = params or {}
+    async with create_async_client() as client:
+        rows = await asyncio.gather(*[
+            fetch_table_rows_async(table_name, client, params.get(table_name))
+            for table_name in table_names
+        ])
+    return dict(zip(table_names, rows))
+
+
+async def spool_table_async(spool: TableSpool, client: httpx.AsyncClient, params: Dict = None) -> TableSpool:
+    async for page in iter_table_pages_async(spool.table_name, client, params, windowed=True):
+        spool.write_page(page)
+    spool.close()
+    return spool
+
+
+async def spool_tables_async(spools: Dict[str, TableSpool], concurrency: int,
+                             params: Dict[str, Dict] = None) -> Dict[str, TableSpool]:
+    """Stream the pages of several tables to their spools, holding a concurrency limit of pages per table"""
+    fetch_controller.start(concurrency)
+    params = params or {}
+    async with create_async_client() as client:
+        await asyncio.gather(*[
+            spool_table_async(spool, client, params.get(table_name))
+            for table_name, spool in spools.items()
+        ])
+    return spools
+
+
+def spool_tables(table_names: List[str], spool_dir: str, concurrency: int,
+                 params: Dict[str, Dict] = None) -> Dict[str, TableSpool]:
+    spools = {table_name: TableSpool(spool_dir, table_name) for table_name in table_names}
+    params = params or {}
+    if concurrency > 1:
+        return asyncio.run(spool_tables_async(spools, concurrency, params))
+    for table_name, spool in spools.items():
+        for page in iter_table_pages(table_name, params.get(table_name)):
+            spool.write_page(page)
+        spool.close()
+    return spools
+
+
+async def fetch_tables_metadata_async(table_names: List[str], concurrency: int) -> Dict[str, Dict]:
+    fetch_controller.start(concurrency)
+    async with create_async_client() as client:
+        metadata = await asyncio.gather(*[
+            fetch_json_async(client, join_url(config["api"]["baseURL"], table_name.lower()),
+                             {"page": 1, "page_size": 1}, table_name)
+            for table_name in table_names
+        ])
+    return dict(zip(table_names, metadata))
+
+
 def fetch_table_metadata(table_name: str) -> Dict:
     result = fetch_table_in_batch(table_name, 1, 1)
     return result
 
 
-def fetch_table(table_name: str) -> Dict:
-    metadata = fetch_table_metadata(table_name)
-    data = fetch_table_rows(table_name)
+def fetch_table(table_name: str, data: List = None, metadata: Dict = None, params: Dict = None) -> Dict:
+    if metadata is None:
+        metadata = fetch_table_metadata(table_name)
+    if data is None:
+        data = fetch_table_rows(table_name, params)
     return {
         "metadata": metadata,
         "data": data,
@@ -299,217 +464,484 @@ def replace_table_name(table_name: str) -> str:
     return table_name
 
 
-def get_related_tables(table_name: str, tables: Dict) -> Dict:
-    related_tables = {table_name: {"incoming": [], "outgoing": []}}
+def build_schema_index(tables: Dict, concurrency: int = None) -> SchemaIndex:
+    """Fetch the metadata of every table once and index its foreign keys, or load a saved index"""
+    index_path = config.get("schemaIndexFile")
+    schema_index = SchemaIndex.load(index_path, tables, config.get("schemaIndexMaxAge", 0))
+    if schema_index:
+        return schema_index
 
-    # Add outgoing foreign keys
-    outgoing: List[str] = []
-    table_metadata = fetch_table_metadata(table_name)
+    concurrency = concurrency or config["api"]["concurrency"]
+    logger.info(f"Building schema index of {len(tables)} tables")
+    if concurrency > 1:
+        tables_metadata = asyncio.run(fetch_tables_metadata_async(list(tables), concurrency))
+    else:
+        tables_metadata = {table: fetch_table_metadata(table) for table in tables}
+    schema_index = SchemaIndex.from_metadata(tables_metadata)
 
-    for related_table in table_metadata.get("metadata", {}).get("foreign_keys", {}).keys():
-        outgoing.append(related_table)
-    related_tables[table_name]["outgoing"] = outgoing
+    if index_path:
+        schema_index.save(index_path, tables)
+    return schema_index
 
-    # Add incoming foreign keys
-    incoming: List[str] = []
-    for table in tables:
-        table_metadata = fetch_table_metadata(table)
-        if table_name in table_metadata.get("metadata", {}).get("foreign_keys", {}).keys():
-            incoming.append(table)
-    related_tables[table_name]["incoming"] = incoming
 
-    return related_tables
+def get_related_tables(table_name: str, tables: Dict, schema_index: SchemaIndex = None) -> Dict:
+    if schema_index is None:
+        schema_index = build_schema_index(tables)
+    return {table_name: schema_index.related_tables(table_name, fetch_table_metadata)}
 
 
 def get_related_tables_with_distance(
         table_name: str,
         tables: Dict,
         distance: int,
-        related_tables: Dict = None
+        schema_index: SchemaIndex = None
 ) -> Dict:
-    if related_tables is None:
-        related_tables = {}
+    if schema_index is None:
+        schema_index = build_schema_index(tables)
 
-    table_name = replace_table_name(table_name)
+    related_tables = schema_index.related_tables_with_distance(table_name, distance, fetch_table_metadata,
+                                                               replace_table_name)
+    logger.info(f"Related tables: {json.dumps(related_tables, indent=2)}")
+    return related_tables
 
-    if distance < 0:
-        return related_tables
 
-    current_related_tables = get_related_tables(table_name, tables)
-    logger.info(f"Current related tables: {json.dumps(current_related_tables, indent=2)}")
-    related_tables[table_name] = current_related_tables[table_name]
-    logger.info(f"Current outgoing: {current_related_tables[table_name].get('outgoing', [])}")
+class RecordIndex:
+    """@ids of the records added to the graph, per table, for O(1) linkage checks"""
 
-    for related_table in current_related_tables[table_name].get("incoming", []) + current_related_tables[
-        table_name].get("outgoing", []):
-        if related_table not in related_tables:
-            get_related_tables_with_distance(related_table, tables, distance - 1, related_tables)
+    def __init__(self):
+        self.tables: Dict[str, set] = {}
+        self.ids: Dict[str, str] = {}
 
-    return related_tables
+    def add(self, table_name: str, record_id: str) -> None:
+        self.tables.setdefault(table_name, set()).add(record_id)
+        self.ids[record_id] = table_name
 
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self.ids
 
-def _add_each_field(key, record_data, table_name_with_prefix, table_name, record, is_outgoing):
-    if table_name == "location" and key == "point":
-        # Special handling for 'point' field in 'location' table
-        record_data[
-            f"{table_name_with_prefix}-{key}"] = f"POINT({record[key]["coordinates"][0]} {record[key]["coordinates"][1]})"
-    else:
-        if key in table_map.keys():
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+# special mapping case for child_location and parent_location to location
+LOCATION_RELATION_FIELDS = ["child_location", "parent_location"]
+
+
+class FieldPlan:
+    """
+    Field mapping of one table, compiled once into a transformer per column.
+    Replaces evaluating the table_map, special cases and outgoing checks for every field of every record.
+    """
+
+    def __init__(self, table_name: str, outgoing: List[str] = None, table_prefix: str = ""):
+        self.table_name = table_name
+        self.table_name_with_prefix = f"{table_prefix}{table_name}" if table_prefix else table_name
+        self.outgoing = set(outgoing or [])
+        self.is_middle = table_name in config["context"]["middleTables"]
+        self.unique_fields = set(config["context"]["uniqueField"])
+        self.id_prefix = join_url(config["context"]["baseURI"], self.table_name_with_prefix)
+        self.columns: Dict[str, tuple[str, Callable[[Any], Any]] | None] = {}
+
+    def column(self, key: str) -> tuple[str, Callable[[Any], Any]] | None:
+        """(term, transformer) of a record field, None for fields left out of the graph"""
+        if key not in self.columns:
+            self.columns[key] = self._compile(key)
+        return self.columns[key]
+
+    def _compile(self, key: str) -> tuple[str, Callable[[Any], Any]] | None:
+        if key in self.unique_fields:
+            return None
+        prefix = self.table_name_with_prefix
+        if self.table_name == "location" and key == "point":
+            # Special handling for 'point' field in 'location' table
+            return f"{prefix}-{key}", lambda value: f"POINT({value["coordinates"][0]} {value["coordinates"][1]})"
+
+        if key in table_map:
             logger.debug(f"Mapping key {key} to {table_map[key]}")
-            if is_outgoing:
-                if table_name in ["locationpartof"] and key in ["child_location", "parent_location"]:
-                    # special mapping case for child_location and parent_location to location
-                    record_data[f"{table_name_with_prefix}-{key}"] = (
-                        {"@id": join_url(config["context"]["baseURI"], table_map[key], record[key])}
-                    )
-                else:
-                    record_data[f"{table_name_with_prefix}-{table_map[key]}"] = (
-                        {"@id": join_url(config["context"]["baseURI"], table_map[key], record[key])}
-                    )
-            elif is_valid_uri(record[key]):
-                if table_name in ["locationpartof"] and key in ["child_location", "parent_location"]:
-                    # special mapping case for child_location and parent_location to location
-                    record_data[f"{table_name_with_prefix}-{key}"] = (
-                        {"@id": record[key]}
-                    )
-                else:
-                    record_data[f"{table_name_with_prefix}-{table_map[key]}"] = (
-                        {"@id": record[key]}
-                    )
+            if self.table_name in ["locationpartof"] and key in LOCATION_RELATION_FIELDS:
+                term = f"{prefix}-{key}"
             else:
-                if table_name in ["locationpartof"] and key in ["child_location", "parent_location"]:
-                    # special mapping case for child_location and parent_location to location
-                    record_data[f"{table_name_with_prefix}-{key}"] = record[key]
-                else:
-                    record_data[f"{table_name_with_prefix}-{table_map[key]}"] = record[key]
+                term = f"{prefix}-{table_map[key]}"
+            target_prefix = join_url(config["context"]["baseURI"], table_map[key])
         else:
-            if is_outgoing:
-                record_data[f"{table_name_with_prefix}-{key}"] = (
-                    {"@id": join_url(config["context"]["baseURI"], key, record[key])})
-            elif is_valid_uri(record[key]):
-                record_data[f"{table_name_with_prefix}-{key}"] = (
-                    {"@id": record[key]})
+            term = f"{prefix}-{key}"
+            target_prefix = join_url(config["context"]["baseURI"], key)
+
+        if key in self.outgoing:
+            return term, lambda value: {"@id": f"{target_prefix}/{str(value).strip("/")}"}
+        return term, lambda value: {"@id": value} if is_valid_uri(value) else value
+
+    def context_terms(self, fields: Dict) -> Dict[str, str]:
+        """JSON-LD context entries of the table's fields"""
+        terms = {self.table_name: self.id_prefix}
+        for field in fields:
+            if field in self.unique_fields:
+                continue
+            if field in table_map:
+                logger.debug(f"Mapping field {field} to {table_map[field]}")
+                suffix = field if field in LOCATION_RELATION_FIELDS else table_map[field]
             else:
-                record_data[f"{table_name_with_prefix}-{key}"] = record[key]
-    return record_data
+                suffix = field
+            terms[f"{self.table_name}-{suffix}"] = join_url(self.id_prefix, suffix)
+        return terms
+
+    def skip(self, value: Any) -> bool:
+        if isinstance(value, str) and value.strip() == "":
+            return True
+        # middle tables keep falsy values such as 0 and False
+        return value is None if self.is_middle else not value
+
+    def convert(self, records: List[Dict], related_tables: Dict = None, check_linkage: bool = False,
+                record_index: RecordIndex = None) -> List[Dict]:
+        """Graph nodes of a batch of records, converted column by column"""
+        nodes = [{"@id": join_url(self.id_prefix, record.get("id")), "@type": self.table_name} for record in records]
+
+        if self.is_middle or not check_linkage:
+            linked = [True] * len(records)
+        elif record_index is not None:
+            linked = [node["@id"] in record_index for node in nodes]
+        else:
+            linked = [is_value_in_json(node["@id"], related_tables) for node in nodes]
+
+        # columns follow the field order of the records, later fields win on a shared term
+        for key in dict.fromkeys(key for record in records for key in record):
+            column = self.column(key)
+            if column is None:
+                continue
+            term, transform = column
+            for node, record, is_linked in zip(nodes, records, linked):
+                value = record.get(key)
+                if not is_linked or self.skip(value):
+                    continue
+                try:
+                    node[term] = transform(value)
+                except Exception as e:
+                    logger.error(f"Error adding record to graph: {e} {config['context']['baseURI']} {key} "
+                                 f"{json.dumps(record, indent=2)}")
+                    raise
+
+        for node in nodes:
+            if record_index is not None:
+                record_index.add(self.table_name, node["@id"])
+            elif related_tables is not None:
+                related_tables[self.table_name].setdefault("records", []).append(node["@id"])
+        return nodes
+
+
+def get_field_plan(table_name: str, related_tables: Dict, table_prefix: str = "") -> FieldPlan:
+    key = (table_name, table_prefix, tuple(related_tables.get(table_name, {}).get("outgoing", [])))
+    if key not in field_plans:
+        field_plans[key] = FieldPlan(table_name, list(key[2]), table_prefix)
+    return field_plans[key]
 
 
 # Record processing
+def build_record(
+        table_name: str,
+        related_tables: Dict,
+        record: Dict,
+        table_prefix: str = "",
+        check_linkage: bool = True,
+        record_index: RecordIndex = None
+) -> Dict:
+    """Graph node of an API record"""
+    field_plan = get_field_plan(table_name, related_tables, table_prefix)
+    return field_plan.convert([record], related_tables, check_linkage, record_index)[0]
+
+
 def add_record_to_graph(
         json_ld: Dict,
         table_name: str,
         related_tables: Dict,
         record: Dict,
         table_prefix: str = "",
-        check_linkage: bool = True
+        check_linkage: bool = True,
+        record_index: RecordIndex = None
 ) -> Dict:
-    graph = json_ld["@graph"]
-    table_name_with_prefix = f"{table_prefix}{table_name}" if table_prefix else table_name
-    record_id = record.get("id")
+    record_data = build_record(table_name, related_tables, record, table_prefix, check_linkage, record_index)
+    json_ld["@graph"].append(record_data)
+    return json_ld
+
+
+def get_processing_order(related_tables: Dict) -> List[tuple[str, str, bool]]:
+    """
+    Tables in the order they are converted: main, resource, then middle tables.
+    Returns (table name, kind, check linkage) tuples.
+    """
+    context = config["context"]
+    order = [(table, "main", False) for table in related_tables if table in context["mainEntryTables"]]
+    order += [(table, "resource", False) for table in related_tables
+              if table not in context["mainEntryTables"] and table not in context["stopTables"]
+              and table not in context["middleTables"]]
+    order += [(table, "middle", True) for table in related_tables if table in context["middleTables"]]
+    return order
+
 
-    record_data = {
-        "@id": join_url(config["context"]["baseURI"], table_name_with_prefix, record_id),
-        "@type": table_name
+def convert_shard(shard_path: str, table_name: str, outgoing: List[str],
+                  records: List[Dict] | tuple[str, int, int], context: Dict, output_format: str) -> tuple[str, int]:
+    """
+    Worker process: convert a chunk of a table's records into its own triple file.
+    The chunk is either a list of records or a (path, start, end) byte range of a spool file.
+    """
+    field_plan = FieldPlan(table_name, outgoing)
+    if isinstance(records, tuple):
+        records = read_range(*records)
+    with TripleEmitter(shard_path, context, output_format) as emitter:
+        for batch in iter_batches(records, config["batchSize"]):
+            for record_data in field_plan.convert(batch):
+                emitter.write(record_data)
+    return shard_path, emitter.triples
+
+
+def get_table_chunks(records: List[Dict] | TableSpool, shard_size: int) -> List[List[Dict] | tuple[str, int, int]]:
+    if isinstance(records, TableSpool):
+        # workers read their byte range of the spool themselves
+        return records.shards(shard_size)
+    return [records[start:start + shard_size] for start in range(0, len(records), shard_size)]
+
+
+def convert_tables_in_parallel(
+        processing_order: List[tuple[str, str, bool]],
+        cache_related_tables: Dict,
+        related_tables: Dict,
+        context: Dict,
+        output_path: str,
+        output_format: str,
+        workers: int,
+        patched_ids: set = None
+) -> int:
+    """
+    Convert every table, in chunks of shardSize records, in a pool of worker processes.
+    Each chunk becomes a shard file; the shards are concatenated in processing order, so the output is
+    the same on every run. Only middle tables are linkage-checked and their records are never gated,
+    so the workers need no shared record index.
+    """
+    shard_dir = f"{output_path}.shards"
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_size = config["shardSize"]
+    triples = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for related_table_name, kind, _ in processing_order:
+            outgoing = related_tables[related_table_name].get("outgoing", [])
+            chunks = get_table_chunks(cache_related_tables[related_table_name]["data"], shard_size)
+            logger.info(f"Converting {kind} table '{related_table_name}' in {len(chunks)} shards")
+            for chunk in chunks:
+                shard_path = os.path.join(shard_dir, f"{len(futures):05d}.{output_format}")
+                futures.append(executor.submit(convert_shard, shard_path, related_table_name, outgoing, chunk,
+                                               context, output_format))
+                if patched_ids is not None:
+                    id_prefix = join_url(config["context"]["baseURI"], related_table_name)
+                    records = read_range(*chunk) if isinstance(chunk, tuple) else chunk
+                    patched_ids.update(join_url(id_prefix, record.get("id")) for record in records)
+
+        with open(output_path, "w", encoding="utf-8") as out:
+            for future in futures:
+                shard_path, shard_triples = future.result()
+                with open(shard_path, "r", encoding="utf-8") as shard:
+                    shutil.copyfileobj(shard, out)
+                os.remove(shard_path)
+                triples += shard_triples
+    os.rmdir(shard_dir)
+    logger.info(f"{triples} triples from {len(futures)} shards written to {output_path}")
+    return triples
+
+
+def get_output_path(output_format: str) -> str:
+    output_dir = config["outputDir"]
+    if output_format == "jsonld":
+        return os.path.join(output_dir, config["outputJsonLd"])
+    if output_format == "nt":
+        return os.path.join(output_dir, f"{os.path.splitext(config['outputRdf'])[0]}.nt")
+    return os.path.join(output_dir, config["outputRdf"])
+
+
+def load_previous_json_ld(file_path: str) -> Dict | None:
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def watermark_params(watermarks: Dict) -> Dict[str, Dict]:
+    """API query parameters selecting the records past each table's watermark"""
+    filter_param = config["incremental"]["filterParam"]
+    return {
+        table: {filter_param.format(field=watermark["field"]): watermark["value"]}
+        for table, watermark in watermarks.items()
     }
 
-    if table_name not in config["context"]["middleTables"]:
-        for key in record:
-            if not check_linkage or is_value_in_json(record_data["@id"], related_tables):
-                if key not in config["context"]["uniqueField"] and record[key]:
-                    if record[key] is None or (isinstance(record[key], str) and record[key].strip() == ""):
-                        continue
-                    is_outgoing = related_tables[table_name].get("outgoing", []) and key in related_tables[table_name][
-                        "outgoing"]
-                    record_data = _add_each_field(key, record_data, table_name_with_prefix, table_name, record,
-                                                  is_outgoing)
-    else:
-        for key in record:
-            if key not in config["context"]["uniqueField"]:
-                if record[key] is None or (isinstance(record[key], str) and record[key].strip() == ""):
-                    continue
-                is_outgoing = related_tables[table_name].get("outgoing", []) and key in related_tables[table_name][
-                    "outgoing"]
-                try:
-                    record_data = _add_each_field(key, record_data, table_name_with_prefix, table_name, record,
-                                                  is_outgoing)
-                except Exception as e:
-                    logger.error(
-                        f"Error adding record to graph: {e} {config['context']['baseURI']} {key} {json.dumps(record, indent=2)}")
-                    raise
 
-    if "records" not in related_tables[table_name]:
-        related_tables[table_name]["records"] = []
+def get_spool_dir(run_id: str, task_name: str) -> str | None:
+    """Spool directory of one run of a fetch task, so runs and tasks at the same time do not share files"""
+    if not config.get("spoolDir"):
+        return None
+    return os.path.join(config["spoolDir"], *(str(part).replace(":", "_").replace("/", "_")
+                                               for part in (run_id, task_name)))
 
-    related_tables[table_name]["records"].append(record_data["@id"])
-    graph.append(record_data)
-    json_ld["@graph"] = graph
-    return json_ld
+
+def remove_spool_dir(spool_dir: str) -> None:
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    # the run directory too, once its last task is done
+    try:
+        os.rmdir(os.path.dirname(spool_dir))
+    except OSError:
+        pass
 
 
-def main(table_name: str, distance: int = 3):
+def main(table_name: str, distance: int = 3, concurrency: int = None, incremental: bool = None,
+         workers: int = None, spool_dir: str = None, watermark_key: str = None):
     if not table_name:
         logger.error("No table name provided")
         return
+    spool_dir = spool_dir or get_spool_dir(f"pid_{os.getpid()}", table_name)
+    # watermarks of the command line are kept apart from those of the DAG tasks
+    watermark_key = watermark_key or "main"
 
     try:
         tables = get_all_endpoints()
-        related_tables = get_related_tables_with_distance(table_name, tables, distance)
+        schema_index = build_schema_index(tables, concurrency)
+        related_tables = get_related_tables_with_distance(table_name, tables, distance, schema_index)
 
         logger.info(f"Working on {len(related_tables)} related tables out of {len(tables)} with distance {distance}")
         logger.debug(json.dumps(related_tables, indent=2))
         logger.info("Adding to graph")
 
         json_ld = init_json_ld()
+        record_index = RecordIndex()
         cache_related_tables = {}
 
-        # Pre-fetch all related tables
+        # jsonld builds the whole graph and converts it with rdflib, nt / ttl stream the triples to a file
+        output_dir = config["outputDir"]
+        output_format = config["outputFormat"]
+        streaming = output_format in ("nt", "ttl")
+        output_path = get_output_path(output_format)
+
+        # Incremental runs only fetch records past the watermarks of the previous run
+        incremental = config["incremental"]["enabled"] if incremental is None else incremental
+        run = {"table_name": table_name, "distance": distance, "baseURL": config["api"]["baseURL"],
+               "outputFormat": output_format}
+        watermarks = {}
+        has_previous_output = incremental and os.path.isfile(output_path)
+        if has_previous_output:
+            watermarks = load_watermarks(config["incremental"]["stateFile"], watermark_key, run)
+        if incremental and not watermarks:
+            logger.info("No watermarks from a previous run, fetching all records")
+            has_previous_output = False
+        params = watermark_params(watermarks)
+
+        # Pre-fetch all related tables, streaming the pages to disk if a spool directory is set
         logger.info("Pre-fetching related tables")
+        concurrency = concurrency or config["api"]["concurrency"]
+        prefetched_rows = {}
+        if spool_dir:
+            logger.info(f"Spooling pages of {len(related_tables)} tables to {spool_dir}")
+            if not streaming:
+                logger.warning("The jsonld output format still holds the whole graph in memory")
+            prefetched_rows = spool_tables(list(related_tables), spool_dir, concurrency, params)
+        elif concurrency > 1:
+            logger.info(f"Fetching pages of {len(related_tables)} tables with concurrency {concurrency}")
+            prefetched_rows = asyncio.run(fetch_tables_rows_async(list(related_tables), concurrency, params))
         for related_table_name in related_tables:
             if related_table_name not in cache_related_tables:
                 logger.info(f"Caching related table: '{related_table_name}'")
-                cache_related_tables[related_table_name] = fetch_table(related_table_name)
-
-        # Process main tables
-        logger.info("Processing main tables")
-        for related_table_name in related_tables:
-            if related_table_name in config["context"]["mainEntryTables"]:
-                logger.info(f"Processing main table: '{related_table_name}'")
-                table = cache_related_tables[related_table_name]
-                json_ld = add_table_fields_to_context(json_ld, related_table_name,
-                                                      table["metadata"]["metadata"].get("fields", {}))
-
-                for record in table["data"]:
-                    json_ld = add_record_to_graph(json_ld, related_table_name, related_tables, record, "", False)
-
-        # Process resource tables
-        logger.info("Processing resource tables")
-        for related_table_name in related_tables:
-            if (related_table_name not in config["context"]["mainEntryTables"] and
-                    related_table_name not in config["context"]["stopTables"] and
-                    related_table_name not in config["context"]["middleTables"]):
-                logger.info(f"Processing resource table: '{related_table_name}'")
-                table = cache_related_tables[related_table_name]
-                json_ld = add_table_fields_to_context(json_ld, related_table_name,
-                                                      table["metadata"]["metadata"].get("fields", {}))
-
-                for record in table["data"]:
-                    json_ld = add_record_to_graph(json_ld, related_table_name, related_tables, record, "", False)
+                cache_related_tables[related_table_name] = fetch_table(related_table_name,
+                                                                       prefetched_rows.get(related_table_name),
+                                                                       schema_index.metadata.get(related_table_name),
+                                                                       params.get(related_table_name))
+
+        if incremental:
+            new_watermarks = {}
+            for related_table_name, table in cache_related_tables.items():
+                watermark = watermarks.get(related_table_name)
+                if watermark:
+                    if isinstance(table["data"], TableSpool):
+                        table["data"] = table["data"].rewrite(
+                            lambda records: newer_records(records, watermark["field"], watermark["value"]),
+                            config["batchSize"])
+                    else:
+                        table["data"] = newer_records(table["data"], watermark["field"], watermark["value"])
+                    logger.info(f"{len(table['data'])} new or changed records in '{related_table_name}'")
+                    new_watermarks[related_table_name] = {
+                        "field": watermark["field"],
+                        "value": max_watermark(table["data"], watermark["field"], watermark["value"])
+                    }
+                    continue
+                field = get_watermark_field(table["metadata"].get("metadata", {}).get("fields", {}),
+                                            config["incremental"]["fields"])
+                if field:
+                    value = max_watermark(table["data"], field)
+                    if value is not None:
+                        new_watermarks[related_table_name] = {"field": field, "value": value}
+
+        # Convert the tables into graph nodes
+        batch_size = config["batchSize"]
+        processing_order = get_processing_order(related_tables)
+        write_path = f"{output_path}.new" if has_previous_output else output_path
+        emitter = None
+        patched_ids = set()
+
+        workers = workers or config["workers"]
+        if workers > 1 and not streaming:
+            logger.warning("Parallel conversion needs nt or ttl output, converting in this process")
+            workers = 1
+        if workers > 1 and multiprocessing.current_process().daemon:
+            logger.warning("Daemon processes cannot start workers, converting in this process")
+            workers = 1
+
+        if workers > 1:
+            # the workers expand terms with the context of all tables
+            for related_table_name, _, _ in processing_order:
+                json_ld = add_table_fields_to_context(
+                    json_ld, related_table_name,
+                    cache_related_tables[related_table_name]["metadata"]["metadata"].get("fields", {}),
+                    field_plan=get_field_plan(related_table_name, related_tables))
+            convert_tables_in_parallel(processing_order, cache_related_tables, related_tables, json_ld["@context"],
+                                       write_path, output_format, workers,
+                                       patched_ids if has_previous_output else None)
+            processing_order = []
+        elif streaming:
+            emitter = TripleEmitter(write_path, json_ld["@context"], output_format)
+            add_node = emitter.write
+        else:
+            add_node = json_ld["@graph"].append
 
-        # Process middle tables
-        for related_table_name in related_tables:
-            if related_table_name in config["context"]["middleTables"]:
-                logger.info(f"Processing middle table: '{related_table_name}'")
+        try:
+            for related_table_name, kind, check_linkage in processing_order:
+                logger.info(f"Processing {kind} table: '{related_table_name}'")
                 table = cache_related_tables[related_table_name]
+                field_plan = get_field_plan(related_table_name, related_tables)
                 json_ld = add_table_fields_to_context(json_ld, related_table_name,
-                                                      table["metadata"]["metadata"].get("fields", {}))
-
-                for record in table["data"]:
-                    json_ld = add_record_to_graph(json_ld, related_table_name, related_tables, record)
+                                                      table["metadata"]["metadata"].get("fields", {}),
+                                                      field_plan=field_plan)
+
+                for batch in iter_batches(table["data"], batch_size):
+                    for record_data in field_plan.convert(batch, related_tables, check_linkage, record_index):
+                        if has_previous_output:
+                            patched_ids.add(record_data["@id"])
+                        add_node(record_data)
+        finally:
+            if emitter:
+                emitter.close()
+            for table in cache_related_tables.values():
+                if isinstance(table["data"], TableSpool):
+                    table["data"].remove()
 
         # Save results
-        output_dir = config["outputDir"]
         os.makedirs(output_dir, exist_ok=True)
 
+        if streaming:
+            if has_previous_output:
+                patch_triples_file(output_path, write_path, patched_ids, output_path)
+                os.remove(write_path)
+            logger.info(f"{output_format} data saved to {output_path}")
+            if incremental:
+                save_watermarks(config["incremental"]["stateFile"], watermark_key, run, new_watermarks)
+            return output_path
+
+        if has_previous_output:
+            json_ld = patch_graph(load_previous_json_ld(output_path), json_ld)
+
         output_json_path: LiteralString = os.path.join(output_dir, config["outputJsonLd"])
         save_json_ld_to_file(json_ld, output_json_path)
 
@@ -522,6 +954,8 @@ def main(table_name: str, distance: int = 3):
                     f.write(turtle)
                 logger.info(f"Turtle data saved to {output_ttl_path}")
                 logger.info(f"Turtle successfully converted from JSON-LD")
+                if incremental:
+                    save_watermarks(config["incremental"]["stateFile"], watermark_key, run, new_watermarks)
                 return turtle
             else:
                 logger.error("TTL is not valid")
@@ -532,14 +966,23 @@ def main(table_name: str, distance: int = 3):
 
         logger.info("Done")
     finally:
+        if spool_dir:
+            remove_spool_dir(spool_dir)
         http_client.close()
+        fetch_controller.log_report()
+        if response_cache:
+            logger.info(f"HTTP cache: {response_cache.stats()}")
 
 
 class FetchAPIWithPageOperator(BaseOperator):
-    def __init__(self, table_name: str, distance: int, output_trace: str, output_store: str, *args, **kwargs):
+    def __init__(self, table_name: str, distance: int, output_trace: str, output_store: str,
+                 concurrency: int = None, incremental: bool = None, workers: int = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.table_name = table_name
         self.distance = distance
+        self.concurrency = concurrency
+        self.incremental = incremental
+        self.workers = workers
         self.output_trace = output_trace
         self.output_store = output_store
         self.logger = logging.getLogger(__name__)
@@ -547,7 +990,16 @@ class FetchAPIWithPageOperator(BaseOperator):
     def execute(self, context):
         step_names: dict = get_step_names(context)
         # Run the main function
-        ttl_data = main(self.table_name, self.distance)
+        spool_dir = get_spool_dir(context["run_id"], f"{self.dag_id}.{self.task_id}")
+        ttl_data = main(self.table_name, self.distance, self.concurrency, self.incremental, self.workers, spool_dir,
+                        f"{self.dag_id}.{self.task_id}")
+        if config["outputFormat"] in ("nt", "ttl"):
+            # streamed output stays on disk, downstream steps read it through the returned path
+            if self.output_store:
+                output_path = f"{step_names.get("current_step").task_id}.{self.output_store}"
+                shutil.copyfile(ttl_data, output_path)
+                self.logger.info(f"{config['outputFormat']} data saved to {output_path}")
+            return ttl_data
         # Push the output to XCom
         if self.output_trace:
             context['ti'].xcom_push(key=f"{step_names.get("current_step").task_id}_{self.output_store}", value=ttl_data)
@@ -563,4 +1015,4 @@ if __name__ == "__main__":
     args = parse_args()
     table_name = args.tableName
     distance: int = args.distance
-    main(table_name, distance)
+    main(table_name, distance, args.concurrency, args.incremental or None, args.workers)
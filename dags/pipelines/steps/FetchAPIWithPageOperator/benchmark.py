@@ -0,0 +1,193 @@
+"""
+Benchmarks of the FetchAPIWithPageOperator conversion path and of whole extractions against the stub API.
+Run from the steps directory, e.g.: python -m FetchAPIWithPageOperator.benchmark linkage
+                                   python -m FetchAPIWithPageOperator.benchmark extract -r 2000 -f jsonld nt
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from typing import Dict, List
+from .stub_api import StubAPI, StubSchema
+
+
+def synthetic_related_tables() -> Dict:
+    return {
+        "location": {"incoming": ["location2source"], "outgoing": []},
+        "source": {"incoming": ["location2source"], "outgoing": []},
+        "location2source": {"incoming": [], "outgoing": ["location", "source"]},
+    }
+
+
+def synthetic_records(count: int) -> Dict[str, List[Dict]]:
+    return {
+        "location": [{"id": i, "name": f"location {i}", "remark": ""} for i in range(1, count + 1)],
+        "location2source": [{"id": i, "location": i, "source": i % 50 + 1, "page": f"p. {i}"}
+                            for i in range(1, count + 1)],
+    }
+
+
+def bench_linkage(count: int, use_index: bool = True) -> Dict:
+    """
+    Time the middle table loop of main() after its main table is in the graph,
+    plus the same records checked for linkage as a regular table.
+    """
+    from .FetchAPIWithPageOperator import init_json_ld, add_record_to_graph, RecordIndex
+
+    related_tables = synthetic_related_tables()
+    records = synthetic_records(count)
+    record_index = RecordIndex() if use_index else None
+    json_ld = init_json_ld()
+    for record in records["location"]:
+        json_ld = add_record_to_graph(json_ld, "location", related_tables, record, "", False, record_index)
+
+    start = time.perf_counter()
+    for record in records["location2source"]:
+        json_ld = add_record_to_graph(json_ld, "location2source", related_tables, record,
+                                      record_index=record_index)
+    for record in records["location"]:
+        json_ld = add_record_to_graph(json_ld, "location", related_tables, record, record_index=record_index)
+    seconds = time.perf_counter() - start
+
+    return {"records": count, "seconds": seconds, "us_per_record": seconds / (2 * count) * 1e6}
+
+
+def count_triples(file_path: str) -> int:
+    if file_path.endswith(".nt"):
+        with open(file_path, "rb") as f:
+            return sum(1 for line in f if line.strip() and not line.startswith(b"#"))
+    from rdflib import Graph
+    return len(Graph().parse(file_path, format="turtle"))
+
+
+def run_extraction(results, table_name: str, distance: int, overrides: Dict) -> None:
+    """Child process: run main() once with the config overrides, reporting wall time, peak memory and triples"""
+    from .config import config
+    from .FetchAPIWithPageOperator import main as fetch_main, setup_api_clients
+
+    for key, value in overrides.items():
+        if isinstance(value, dict):
+            config[key] = {**config.get(key, {}), **value}
+        else:
+            config[key] = value
+    # the client and cache were set up on import, with the config as it was then
+    setup_api_clients()
+    logging.getLogger().setLevel(config["logLevel"].upper())
+
+    start = time.perf_counter()
+    output = fetch_main(table_name, distance)
+    seconds = time.perf_counter() - start
+    if output is None:
+        results.put({"error": "main() returned no output"})
+        return
+    output_path = output if config["outputFormat"] in ("nt", "ttl") else os.path.join(config["outputDir"],
+                                                                                     config["outputRdf"])
+    results.put({
+        "seconds": seconds,
+        # ru_maxrss is in kilobytes on Linux, conversion worker processes are counted separately
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers_peak_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "triples": count_triples(output_path),
+    })
+
+
+def bench_extraction(api: StubAPI, table_name: str, distance: int, output_format: str, concurrency: int,
+                     workers: int, work_dir: str, http_cache: bool = False) -> Dict:
+    """Run main() against the stub API in a fresh process, so peak memory covers this run only"""
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    overrides = {
+        "logLevel": "warning",
+        "outputDir": run_dir,
+        "outputFormat": output_format,
+        "workers": workers,
+        "spoolDir": os.path.join(run_dir, "spool"),
+        "schemaIndexFile": "",
+        "incremental": {"enabled": False},
+        "httpCache": {"dir": os.path.join(work_dir, "http_cache") if http_cache else ""},
+        "api": {"baseURL": api.base_url, "concurrency": concurrency},
+    }
+    api.reset_counters()
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_extraction, args=(results, table_name, distance, overrides))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise Exception(f"Extraction failed with exit code {process.exitcode}")
+    result = results.get()
+    if "error" in result:
+        raise Exception(f"Extraction failed: {result['error']}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    return {
+        "table": table_name,
+        "distance": distance,
+        "format": output_format,
+        "concurrency": concurrency,
+        "workers": workers,
+        "rows": api.schema.counts.get(table_name),
+        "requests": api.requests,
+        "failures": api.failures,
+        **result,
+        "triples_per_second": result["triples"] / result["seconds"] if result["seconds"] else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the FetchAPIWithPageOperator conversion path")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    linkage = subparsers.add_parser("linkage", help="Middle table processing time against record count")
+    linkage.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000, 16000, 32000])
+    linkage.add_argument("--legacy", action="store_true", help="Check linkage by scanning related_tables")
+    extract = subparsers.add_parser("extract", help="Whole extractions with main() against the stub API")
+    extract.add_argument("-t", "--tableName", default="location")
+    extract.add_argument("-d", "--distance", type=int, default=2)
+    extract.add_argument("-r", "--rows", type=int, nargs="+", default=[1000], help="Rows of the location table")
+    extract.add_argument("-f", "--formats", nargs="+", default=["jsonld", "nt"], choices=["jsonld", "nt", "ttl"])
+    extract.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 8])
+    extract.add_argument("-w", "--workers", type=int, nargs="+", default=[1])
+    extract.add_argument("-n", "--repeat", type=int, default=1)
+    extract.add_argument("--max-page-size", type=int, default=100)
+    extract.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API response")
+    extract.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of API requests failing")
+    extract.add_argument("--http-cache", action="store_true", help="Keep the HTTP cache between runs")
+    extract.add_argument("-o", "--output", help="Append the results as JSON lines to this file")
+    args = parser.parse_args()
+
+    if args.benchmark == "linkage":
+        print(f"{'records':>10} {'seconds':>10} {'us/record':>10}")
+        for size in args.sizes:
+            result = bench_linkage(size, not args.legacy)
+            print(f"{result['records']:>10} {result['seconds']:>10.3f} {result['us_per_record']:>10.2f}")
+
+    if args.benchmark == "extract":
+        work_dir = tempfile.mkdtemp(prefix="fetch_benchmark_")
+        print(f"{'rows':>8} {'format':>7} {'conc':>5} {'workers':>7} {'requests':>9} {'seconds':>9} "
+              f"{'peak MB':>8} {'triples':>9} {'triples/s':>10}")
+        try:
+            for rows in args.rows:
+                with StubAPI(StubSchema(rows), max_page_size=args.max_page_size, latency=args.latency,
+                             failure_rate=args.failure_rate) as api:
+                    for output_format in args.formats:
+                        for concurrency in args.concurrency:
+                            for workers in args.workers:
+                                for _ in range(args.repeat):
+                                    result = bench_extraction(api, args.tableName, args.distance, output_format,
+                                                              concurrency, workers, work_dir, args.http_cache)
+                                    print(f"{result['rows']:>8} {output_format:>7} {concurrency:>5} "
+                                          f"{workers:>7} {result['requests']:>9} {result['seconds']:>9.2f} "
+                                          f"{result['peak_mb']:>8.1f} {result['triples']:>9} "
+                                          f"{result['triples_per_second']:>10.0f}")
+                                    if args.output:
+                                        with open(args.output, "a", encoding="utf-8") as f:
+                                            f.write(json.dumps({"time": time.time(), **result}) + "\n")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
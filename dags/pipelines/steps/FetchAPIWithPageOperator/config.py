@@ -4,8 +4,48 @@ config = {
     "outputDir": "/tmp",
     "outputJsonLd": "output.jsonld",
     "outputRdf": "output.ttl",
+    # jsonld: build the JSON-LD graph and convert it to Turtle with rdflib;
+    # nt / ttl: write N-Triples / flat Turtle straight from the records, without the JSON-LD output
+    "outputFormat": "jsonld",
+    # records converted per batch by a table's compiled field plan
+    "batchSize": 1000,
+    # fetched pages are streamed to an NDJSON file per table and read back lazily, in a directory per run and task
+    # below this one that is removed after conversion; empty to keep them in memory
+    "spoolDir": "/tmp/spool",
+    # processes converting tables in parallel (nt / ttl output only), each writing shards of shardSize records
+    "workers": 1,
+    "shardSize": 50000,
+    # foreign key graph of the API tables, kept between runs; empty to rebuild it every run
+    "schemaIndexFile": "/tmp/schema_index.json",
+    "schemaIndexMaxAge": 86400,
+    # incremental runs fetch only records past the previous run's high-water mark and patch its output
+    "incremental": {
+        "enabled": False,
+        # marks of each DAG task under its own key, written under a lock
+        "stateFile": "/tmp/watermarks.json",
+        # first field a table has is its watermark, otherwise its id
+        "fields": ["modified", "updated_at", "last_modified"],
+        "filterParam": "{field}__gt"
+    },
+    # conditional-GET cache of API responses; empty dir to disable
+    "httpCache": {
+        "dir": "/tmp/http_cache",
+        "maxBytes": 512 * 1024 * 1024
+    },
     "api": {
-        "baseURL": "http://host.docker.internal/api/"
+        "baseURL": "http://host.docker.internal/api/",
+        # number of pages fetched in parallel; 1 walks `links.next` one page at a time
+        "concurrency": 8,
+        "pageSize": 100,
+        # concurrency adapts between 1 and maxConcurrency: it grows while request latency stays within
+        # latencyTolerance times the fastest seen, and halves on errors, 429/503 or slow responses
+        "maxConcurrency": 32,
+        "latencyTolerance": 2.0,
+        "timeout": 10.0,
+        # failed requests (timeouts, 429, 5xx) are retried with jittered exponential backoff, or after Retry-After
+        "retries": 5,
+        "backoff": 0.5,
+        "maxBackoff": 30.0
     },
     "context": {
         "baseURI": "http://example.globalise.nl/temp",
@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+from typing import Dict, List, Any, Iterator, Set
+from rdflib import Graph, URIRef, BNode, Literal
+
+logger = logging.getLogger(__name__)
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# characters that must be escaped in an IRI reference
+IRI_ESCAPES = {c: f"\\u{ord(c):04X}" for c in '<>"{}|^`\\ '}
+IRI_ESCAPES.update({chr(c): f"\\u{c:04X}" for c in range(0x20)})
+LITERAL_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"}
+
+
+def format_iri(iri: str) -> str:
+    return "<" + "".join(IRI_ESCAPES.get(c, c) for c in iri) + ">"
+
+
+def format_literal(value: str, datatype: str = None, language: str = None) -> str:
+    literal = '"' + "".join(LITERAL_ESCAPES.get(c, c) for c in value) + '"'
+    if language:
+        return f"{literal}@{language}"
+    if datatype:
+        return f"{literal}^^{format_iri(datatype)}"
+    return literal
+
+
+def format_value(value: Any) -> str | None:
+    """A JSON value as an RDF object, the same way the JSON-LD parser maps it"""
+    if isinstance(value, bool):
+        return format_literal("true" if value else "false", f"{XSD}boolean")
+    if isinstance(value, int):
+        return format_literal(str(value), f"{XSD}integer")
+    if isinstance(value, float):
+        return format_literal(repr(value), f"{XSD}double")
+    if isinstance(value, str):
+        return format_literal(value)
+    if isinstance(value, dict) and set(value) == {"@id"} and isinstance(value["@id"], str):
+        return format_iri(value["@id"])
+    return None
+
+
+def format_term(term) -> str:
+    if isinstance(term, URIRef):
+        return format_iri(str(term))
+    if isinstance(term, BNode):
+        return f"_:b{term}"
+    if isinstance(term, Literal):
+        return format_literal(str(term), str(term.datatype) if term.datatype else None, term.language)
+    raise ValueError(f"Unexpected RDF term: {term!r}")
+
+
+class TripleEmitter:
+    """
+    Writes graph nodes built for the JSON-LD @graph straight to an N-Triples or flat Turtle file.
+    Terms are expanded with the JSON-LD context the nodes were built for, so the triples are the
+    same as parsing the JSON-LD document, without holding the graph in memory.
+    """
+
+    def __init__(self, file_path: str, context: Dict, output_format: str = "nt"):
+        if output_format not in ("nt", "ttl"):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.file_path = file_path
+        # the context grows as tables are added, so it is read at write time
+        self.context = context
+        self.output_format = output_format
+        self.triples = 0
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        self.file = open(file_path, "w", encoding="utf-8")
+
+    def __enter__(self) -> "TripleEmitter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            logger.info(f"{self.triples} triples written to {self.file_path}")
+
+    def expand(self, term: str) -> str:
+        iri = self.context.get(term)
+        if isinstance(iri, str):
+            return iri
+        return f"{self.context['@vocab']}{term}"
+
+    def node_triples(self, node: Dict) -> List[tuple[str, str]] | None:
+        """(predicate, object) pairs of a node, None if it holds values only the JSON-LD parser handles"""
+        pairs = []
+        for key, value in node.items():
+            if key == "@id":
+                continue
+            if key == "@type":
+                for type_name in value if isinstance(value, list) else [value]:
+                    pairs.append((format_iri(RDF_TYPE), format_iri(self.expand(type_name))))
+                continue
+            if key.startswith("@"):
+                return None
+            predicate = format_iri(self.expand(key))
+            for item in value if isinstance(value, list) else [value]:
+                if item is None:
+                    continue
+                rdf_object = format_value(item)
+                if rdf_object is None:
+                    return None
+                pairs.append((predicate, rdf_object))
+        return pairs
+
+    def fallback_triples(self, node: Dict) -> Iterator[tuple[str, str, str]]:
+        graph = Graph()
+        graph.parse(data=json.dumps({"@context": self.context, "@graph": [node]}), format="json-ld")
+        for s, p, o in graph:
+            yield format_term(s), format_term(p), format_term(o)
+
+    def write(self, node: Dict) -> None:
+        subject = format_iri(node["@id"])
+        pairs = self.node_triples(node)
+        if pairs is None:
+            # nested objects (blank nodes, value objects) go through rdflib
+            lines = [f"{s} {p} {o} .\n" for s, p, o in self.fallback_triples(node)]
+            self.triples += len(lines)
+            self.file.writelines(lines)
+            return
+        # duplicate values collapse into one triple, as in a graph
+        pairs = list(dict.fromkeys(pairs))
+        self.triples += len(pairs)
+        if not pairs:
+            return
+        if self.output_format == "nt":
+            self.file.writelines(f"{subject} {p} {o} .\n" for p, o in pairs)
+        else:
+            body = " ;\n    ".join(f"{p} {o}" for p, o in pairs)
+            self.file.write(f"{subject} {body} .\n\n")
+
+
+def _subject(line: str) -> str | None:
+    if not line.startswith("<"):
+        return None
+    end = line.find(">")
+    return line[:end + 1] if end > 0 else None
+
+
+def patch_triples_file(previous_path: str, new_path: str, replaced_ids: Set[str], output_path: str) -> None:
+    """
+    Copy a previous emitter output without the statements about replaced_ids, then append new_path.
+    Works line by line on N-Triples and block by block on the flat Turtle written by TripleEmitter.
+    """
+    replaced_subjects = {format_iri(record_id) for record_id in replaced_ids}
+    tmp_path = f"{output_path}.tmp"
+    skipped = 0
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        with open(previous_path, "r", encoding="utf-8") as previous:
+            skipping = False
+            for line in previous:
+                if line[:1] not in (" ", "\n"):
+                    # a new statement starts on an unindented line
+                    skipping = _subject(line) in replaced_subjects
+                    skipped += skipping
+                if not skipping:
+                    out.write(line)
+        with open(new_path, "r", encoding="utf-8") as new:
+            for line in new:
+                out.write(line)
+    os.replace(tmp_path, output_path)
+    logger.info(f"Patched {output_path}: {skipped} previous statements replaced")
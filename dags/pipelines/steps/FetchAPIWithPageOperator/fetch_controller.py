@@ -0,0 +1,190 @@
+import time
+import random
+import asyncio
+import logging
+import httpx
+from email.utils import parsedate_to_datetime
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# responses worth another try; anything else that is not a 200 fails at once
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# responses that mean the API is overloaded and concurrency should back off
+OVERLOAD_STATUS = {429, 503}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def status_of(response: httpx.Response | None) -> int | None:
+    return response.status_code if response is not None else None
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class FetchController:
+    """
+    Retries API requests with jittered exponential backoff, honouring Retry-After, and adapts the
+    number of requests in flight AIMD-style: one more slot per round trip while latency stays within
+    latencyTolerance times the fastest observed latency, half the slots on overload, errors or slow
+    responses. Request latencies are kept per table for the run report.
+    """
+
+    def __init__(self, api_config: Dict):
+        self.timeout = api_config.get("timeout", 10.0)
+        self.retries = api_config.get("retries", 5)
+        self.backoff = api_config.get("backoff", 0.5)
+        self.max_backoff = api_config.get("maxBackoff", 30.0)
+        self.max_concurrency = api_config.get("maxConcurrency", 32)
+        self.latency_tolerance = api_config.get("latencyTolerance", 2.0)
+        self.limit = float(api_config.get("concurrency", 1))
+        self.in_flight = 0
+        self.condition = None
+        self.base_latency = None
+        self.last_decrease = 0.0
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.retried: Dict[str, int] = {}
+
+    def start(self, concurrency: int) -> None:
+        """Begin an async fetch with this initial concurrency; call inside the running event loop"""
+        self.limit = float(max(1, min(concurrency, self.max_concurrency)))
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    def create_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout)
+
+    # AIMD limit
+    def increase(self) -> None:
+        if self.limit < self.max_concurrency:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        # one cut per round trip, the requests already in flight saw the same congestion
+        if now - self.last_decrease < (self.base_latency or 0.0) * self.latency_tolerance:
+            return
+        self.last_decrease = now
+        limit = max(1.0, self.limit / 2)
+        if int(limit) != int(self.limit):
+            logger.info(f"Lowering API concurrency to {int(limit)} ({reason})")
+        self.limit = limit
+
+    def observe(self, table_name: str, seconds: float, status_code: int | None) -> None:
+        self.latencies.setdefault(table_name, []).append(seconds)
+        if status_code is None or status_code in RETRY_STATUS:
+            self.errors[table_name] = self.errors.get(table_name, 0) + 1
+            self.decrease("overloaded" if status_code in OVERLOAD_STATUS else f"error {status_code}")
+            return
+        if self.base_latency is None or seconds < self.base_latency:
+            self.base_latency = seconds
+        # jitter of a few milliseconds on a fast API is not congestion
+        if seconds > self.base_latency * self.latency_tolerance and seconds > 0.05:
+            self.decrease(f"latency {seconds:.2f}s")
+        else:
+            self.increase()
+
+    def retry_delay(self, attempt: int, response: httpx.Response | None) -> float:
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def should_retry(self, table_name: str, attempt: int, url: str, response: httpx.Response | None,
+                     error: Exception | None) -> bool:
+        if response is not None and response.status_code not in RETRY_STATUS:
+            return False
+        if attempt >= self.retries:
+            return False
+        self.retried[table_name] = self.retried.get(table_name, 0) + 1
+        reason = f"status {response.status_code}" if response is not None else f"{type(error).__name__}"
+        logger.warning(f"Retrying {url} ({reason}), attempt {attempt + 1} of {self.retries}")
+        return True
+
+    # requests
+    def get(self, client: httpx.Client, url: str, params: Dict = None, table_name: str = "") -> httpx.Response:
+        attempt = 0
+        while True:
+            response, error = None, None
+            start = time.perf_counter()
+            try:
+                response = client.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            self.observe(table_name, time.perf_counter() - start, status_of(response))
+            if not self.should_retry(table_name, attempt, url, response, error):
+                break
+            time.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+        if error:
+            raise error
+        return response
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    async def get_async(self, client: httpx.AsyncClient, url: str, params: Dict = None,
+                        table_name: str = "") -> httpx.Response:
+        attempt = 0
+        while True:
+            response, error = None, None
+            await self.acquire()
+            start = time.perf_counter()
+            try:
+                response = await client.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                self.observe(table_name, time.perf_counter() - start, status_of(response))
+                await self.release()
+            if not self.should_retry(table_name, attempt, url, response, error):
+                break
+            # back off without holding a slot
+            await asyncio.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+        if error:
+            raise error
+        return response
+
+    def report(self) -> Dict[str, Dict]:
+        """Per-table request count, errors, retries and latency percentiles in milliseconds"""
+        report = {}
+        for table_name, latencies in self.latencies.items():
+            report[table_name or "-"] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(table_name, 0),
+                "retries": self.retried.get(table_name, 0),
+                **{f"p{int(q * 100)}": round(percentile(latencies, q) * 1000, 1) for q in (0.5, 0.9, 0.99)},
+            }
+        return report
+
+    def log_report(self) -> None:
+        for table_name, stats in self.report().items():
+            logger.info(f"API latency '{table_name}': {stats}")
+        if self.condition is not None:
+            logger.info(f"Final API concurrency: {int(self.limit)}")
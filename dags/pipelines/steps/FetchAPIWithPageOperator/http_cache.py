@@ -0,0 +1,233 @@
+import os
+import json
+import httpx
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# response headers kept with a cached body
+STORED_HEADERS = ["content-type", "content-encoding", "etag", "last-modified"]
+
+
+class ResponseCache:
+    """
+    On-disk store of GET response bodies keyed by URL, bounded in size with LRU eviction.
+    Only responses carrying an ETag or Last-Modified are stored, since they are revalidated before use.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries: OrderedDict = self._load_index()
+        self.total_bytes = sum(entry["size"] for entry in self.entries.values())
+
+    def _load_index(self) -> OrderedDict:
+        if not os.path.isfile(self.index_path):
+            return OrderedDict()
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return OrderedDict(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable HTTP cache index {self.index_path}: {e}")
+            return OrderedDict()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.body")
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for a cached URL, empty if the URL is not cached"""
+        with self.lock:
+            entry = self.entries.get(self._key(url))
+        if not entry:
+            return {}
+        headers = {}
+        if entry["headers"].get("etag"):
+            headers["If-None-Match"] = entry["headers"]["etag"]
+        if entry["headers"].get("last-modified"):
+            headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+        return headers
+
+    def get(self, url: str) -> tuple[Dict, bytes] | None:
+        """Headers and body of a cached URL, marking it as most recently used"""
+        key = self._key(url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._body_path(key), "rb") as f:
+                return entry["headers"], f.read()
+        except OSError:
+            self._remove(key)
+            return None
+
+    def put(self, url: str, headers: httpx.Headers, body: bytes) -> None:
+        stored_headers = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        if not stored_headers.get("etag") and not stored_headers.get("last-modified"):
+            return
+        if len(body) > self.max_bytes:
+            return
+        key = self._key(url)
+        with open(self._body_path(key), "wb") as f:
+            f.write(body)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.total_bytes -= previous["size"]
+            self.entries[key] = {"url": url, "headers": stored_headers, "size": len(body)}
+            self.total_bytes += len(body)
+            evicted = []
+            while self.total_bytes > self.max_bytes and self.entries:
+                old_key, old_entry = self.entries.popitem(last=False)
+                self.total_bytes -= old_entry["size"]
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._delete_body(old_key)
+
+    def _remove(self, key: str) -> None:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.total_bytes -= entry["size"]
+        self._delete_body(key)
+
+    def _delete_body(self, key: str) -> None:
+        try:
+            os.remove(self._body_path(key))
+        except FileNotFoundError:
+            pass
+
+    def record_hit(self, size: int) -> None:
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def record_miss(self) -> None:
+        with self.lock:
+            self.misses += 1
+
+    def save(self) -> None:
+        with self.lock:
+            entries = dict(self.entries)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes
+            }
+
+
+def _conditional_request(cache: ResponseCache, request: httpx.Request) -> bool:
+    if request.method != "GET":
+        return False
+    request.headers.update(cache.validators(str(request.url)))
+    return True
+
+
+def _unconditional_request(request: httpx.Request) -> httpx.Request:
+    # used when a 304 arrives for a body evicted in the meantime
+    headers = [(name, value) for name, value in request.headers.multi_items()
+               if name.lower() not in ("if-none-match", "if-modified-since")]
+    return httpx.Request(request.method, request.url, headers=headers, extensions=request.extensions)
+
+
+def _cached_response(cache: ResponseCache, request: httpx.Request) -> httpx.Response | None:
+    """Serve a 304 Not Modified from disk"""
+    cached = cache.get(str(request.url))
+    if cached is None:
+        return None
+    headers, body = cached
+    cache.record_hit(len(body))
+    return httpx.Response(200, headers=headers, content=body, request=request)
+
+
+def _fresh_response(cache: ResponseCache, request: httpx.Request, response: httpx.Response,
+                    body: bytes) -> httpx.Response:
+    # the raw (still encoded) body is stored, so the client decodes it as usual
+    cache.record_miss()
+    if response.status_code == 200:
+        cache.put(str(request.url), response.headers, body)
+    headers = [(name, value) for name, value in response.headers.multi_items() if name.lower() != "transfer-encoding"]
+    return httpx.Response(response.status_code, headers=headers, content=body, request=request,
+                          extensions=response.extensions)
+
+
+class CachingTransport(httpx.BaseTransport):
+    """httpx transport revalidating cached GET responses with If-None-Match / If-Modified-Since"""
+
+    def __init__(self, cache: ResponseCache, transport: httpx.BaseTransport = None):
+        self.cache = cache
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not _conditional_request(self.cache, request):
+            return self.transport.handle_request(request)
+        response = self.transport.handle_request(request)
+        if response.status_code == 304:
+            cached = _cached_response(self.cache, request)
+            response.close()
+            if cached is not None:
+                return cached
+            request = _unconditional_request(request)
+            response = self.transport.handle_request(request)
+        try:
+            body = b"".join(response.iter_raw())
+        finally:
+            response.close()
+        return _fresh_response(self.cache, request, response, body)
+
+    def close(self) -> None:
+        self.transport.close()
+        self.cache.save()
+
+
+class AsyncCachingTransport(httpx.AsyncBaseTransport):
+    """Async variant of CachingTransport sharing the same ResponseCache"""
+
+    def __init__(self, cache: ResponseCache, transport: httpx.AsyncBaseTransport = None):
+        self.cache = cache
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not _conditional_request(self.cache, request):
+            return await self.transport.handle_async_request(request)
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 304:
+            cached = _cached_response(self.cache, request)
+            await response.aclose()
+            if cached is not None:
+                return cached
+            request = _unconditional_request(request)
+            response = await self.transport.handle_async_request(request)
+        try:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        return _fresh_response(self.cache, request, response, body)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+        self.cache.save()
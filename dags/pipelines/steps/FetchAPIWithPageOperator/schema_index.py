@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaIndex:
+    """
+    In-memory foreign key graph of the API tables.
+    Built from the metadata of every table once, so the related tables of a table can be found
+    without fetching the metadata again for every visited table.
+    """
+
+    def __init__(self, outgoing: Dict[str, List[str]], metadata: Dict[str, Dict] = None):
+        # table -> foreign key names, in API order
+        self.outgoing = outgoing
+        # full metadata responses fetched during this run, reused when fetching the tables
+        self.metadata = metadata or {}
+        self.incoming = self._build_incoming(outgoing)
+
+    @staticmethod
+    def _build_incoming(outgoing: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        incoming: Dict[str, List[str]] = {}
+        for table, foreign_keys in outgoing.items():
+            for foreign_key in foreign_keys:
+                incoming.setdefault(foreign_key, []).append(table)
+        return incoming
+
+    @classmethod
+    def from_metadata(cls, tables_metadata: Dict[str, Dict]) -> "SchemaIndex":
+        outgoing = {
+            table: list(table_metadata.get("metadata", {}).get("foreign_keys", {}).keys())
+            for table, table_metadata in tables_metadata.items()
+        }
+        return cls(outgoing, dict(tables_metadata))
+
+    @classmethod
+    def load(cls, file_path: str, tables: Dict, max_age: int) -> "SchemaIndex | None":
+        """Load a saved index, unless it is older than max_age seconds or the API tables changed"""
+        if not file_path or not os.path.isfile(file_path):
+            return None
+        if max_age and time.time() - os.path.getmtime(file_path) > max_age:
+            logger.info(f"Schema index {file_path} is older than {max_age}s, rebuilding")
+            return None
+        with open(file_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if sorted(saved.get("tables", [])) != sorted(tables):
+            logger.info(f"API tables changed since {file_path} was saved, rebuilding")
+            return None
+        logger.info(f"Loaded schema index from {file_path}")
+        return cls(saved["outgoing"])
+
+    def save(self, file_path: str, tables: Dict) -> None:
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump({"tables": list(tables), "outgoing": self.outgoing}, f, indent=2)
+        logger.info(f"Schema index saved to {file_path}")
+
+    def related_tables(self, table_name: str, fetch_metadata: Callable[[str], Dict]) -> Dict:
+        if table_name not in self.outgoing:
+            # tables outside the endpoint list (e.g. stop tables) are looked up on demand
+            table_metadata = fetch_metadata(table_name)
+            self.metadata[table_name] = table_metadata
+            self.outgoing[table_name] = list(table_metadata.get("metadata", {}).get("foreign_keys", {}).keys())
+        return {
+            "incoming": list(self.incoming.get(table_name, [])),
+            "outgoing": list(self.outgoing[table_name])
+        }
+
+    def related_tables_with_distance(
+            self,
+            table_name: str,
+            distance: int,
+            fetch_metadata: Callable[[str], Dict],
+            replace_table_name: Callable[[str], str]
+    ) -> Dict:
+        """Breadth-first search over the foreign keys, returning every table within distance"""
+        related_tables: Dict = {}
+        if distance < 0:
+            return related_tables
+
+        queue = deque([(replace_table_name(table_name), 0)])
+        seen = {queue[0][0]}
+        while queue:
+            current, depth = queue.popleft()
+            related_tables[current] = self.related_tables(current, fetch_metadata)
+            if depth == distance:
+                continue
+            for related_table in related_tables[current]["incoming"] + related_tables[current]["outgoing"]:
+                related_table = replace_table_name(related_table)
+                if related_table not in seen:
+                    seen.add(related_table)
+                    queue.append((related_table, depth + 1))
+
+        return related_tables
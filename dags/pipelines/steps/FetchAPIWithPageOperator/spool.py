@@ -0,0 +1,87 @@
+import os
+import json
+import logging
+from itertools import islice
+from typing import Dict, List, Iterator, Iterable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class TableSpool:
+    """
+    Records of one table in an NDJSON file on disk, written a page at a time and read back lazily,
+    so a table never has to fit in memory.
+    """
+
+    def __init__(self, spool_dir: str, table_name: str):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.table_name = table_name
+        self.path = os.path.join(spool_dir, f"{table_name}.ndjson")
+        self.count = 0
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def write_page(self, records: List[Dict]) -> None:
+        self.file.writelines(json.dumps(record) + "\n" for record in records)
+        self.count += len(records)
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            logger.debug(f"Spooled {self.count} records of '{self.table_name}' to {self.path}")
+
+    def __iter__(self) -> Iterator[Dict]:
+        self.close()
+        yield from read_range(self.path)
+
+    def rewrite(self, transform: Callable[[List[Dict]], List[Dict]], batch_size: int) -> "TableSpool":
+        """Pass the records through transform a batch at a time, e.g. to filter them"""
+        self.close()
+        tmp_path = f"{self.path}.tmp"
+        count = 0
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for batch in iter_batches(read_range(self.path), batch_size):
+                records = transform(batch)
+                out.writelines(json.dumps(record) + "\n" for record in records)
+                count += len(records)
+        os.replace(tmp_path, self.path)
+        self.count = count
+        return self
+
+    def shards(self, shard_size: int) -> List[tuple[str, int, int]]:
+        """(path, start, end) byte ranges of shard_size records each"""
+        self.close()
+        ranges = []
+        with open(self.path, "rb") as f:
+            start = 0
+            while True:
+                lines = sum(1 for _ in islice(f, shard_size))
+                if not lines:
+                    break
+                end = f.tell()
+                ranges.append((self.path, start, end))
+                start = end
+        return ranges
+
+    def remove(self) -> None:
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def read_range(path: str, start: int = 0, end: int = None) -> Iterator[Dict]:
+    """Records of a spool file, optionally only those in the byte range [start, end)"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        for line in f:
+            yield json.loads(line)
+            if end is not None and f.tell() >= end:
+                break
+
+
+def iter_batches(records: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
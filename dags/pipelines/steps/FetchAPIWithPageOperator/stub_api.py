@@ -0,0 +1,236 @@
+"""
+Local stand-in for the Globalise Django REST API, serving synthetic tables with the same response shape:
+the table endpoints on the root, paginated `results` with `count` and `links.next`, and `metadata.fields` /
+`metadata.foreign_keys` on every page.
+Run from the steps directory, e.g.: python -m FetchAPIWithPageOperator.stub_api --rows 1000 --latency 0.02
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any
+
+# table -> fields, foreign keys (field -> table) and row count relative to --rows
+DEFAULT_SCHEMA = {
+    "location": {
+        "fields": ["id", "name", "remark", "lifespan", "point", "modified"],
+        "foreign_keys": {"lifespan": "timespan"},
+        "rows": 1.0,
+    },
+    "timespan": {
+        "fields": ["id", "begin", "end", "modified"],
+        "foreign_keys": {},
+        "rows": 0.1,
+    },
+    "source": {
+        "fields": ["id", "title", "url", "modified"],
+        "foreign_keys": {},
+        "rows": 0.05,
+    },
+    "location2source": {
+        "fields": ["id", "location", "source", "page", "modified"],
+        "foreign_keys": {"location": "location", "source": "source"},
+        "rows": 2.0,
+    },
+    "locationlabel": {
+        "fields": ["id", "location", "name", "language", "modified"],
+        "foreign_keys": {"location": "location"},
+        "rows": 1.5,
+    },
+    "locationlabel2source": {
+        "fields": ["id", "locationlabel", "source", "modified"],
+        "foreign_keys": {"locationlabel": "locationlabel", "source": "source"},
+        "rows": 1.5,
+    },
+    "polity": {
+        "fields": ["id", "name", "lifespan", "modified"],
+        "foreign_keys": {"lifespan": "timespan"},
+        "rows": 0.2,
+    },
+}
+
+
+class StubSchema:
+    """Synthetic tables; every row is derived from its table and id, so runs see the same data"""
+
+    def __init__(self, rows: int = 1000, schema: Dict = None):
+        self.schema = schema or DEFAULT_SCHEMA
+        self.counts = {table: max(1, int(rows * spec["rows"])) for table, spec in self.schema.items()}
+
+    def row(self, table: str, row_id: int) -> Dict[str, Any]:
+        spec = self.schema[table]
+        row = {}
+        for field in spec["fields"]:
+            if field == "id":
+                row[field] = row_id
+            elif field in spec["foreign_keys"]:
+                row[field] = (row_id * 7 + len(field)) % self.counts[spec["foreign_keys"][field]] + 1
+            elif field == "point":
+                row[field] = {"type": "Point", "coordinates": [round(100 + row_id % 360 / 7, 4), row_id % 90]}
+            elif field in ("begin", "end"):
+                row[field] = 1600 + row_id % 200 + (10 if field == "end" else 0)
+            elif field == "url":
+                row[field] = f"https://example.org/{table}/{row_id}" if row_id % 2 else ""
+            elif field == "modified":
+                # later ids change later, so a watermark filter returns a tail of the table
+                row[field] = f"2024-01-01T00:00:{row_id:08d}"
+            else:
+                row[field] = f"{table} {field} {row_id}" if row_id % 5 else ""
+        return row
+
+    def rows(self, table: str, start: int, stop: int, filters: Dict[str, str]) -> tuple[list, int]:
+        """Rows [start, stop) of the table after the `{field}__gt` filters, with the filtered count"""
+        if not filters:
+            count = self.counts[table]
+            return [self.row(table, row_id) for row_id in range(start + 1, min(stop, count) + 1)], count
+        matching = [row for row in (self.row(table, row_id) for row_id in range(1, self.counts[table] + 1))
+                    if all(str(row.get(field)) > value for field, value in filters.items())]
+        return matching[start:stop], len(matching)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # concurrent clients would otherwise overflow the listen backlog and wait for SYN retries
+    request_queue_size = 128
+
+
+class StubAPI:
+    """
+    Threaded HTTP server for a StubSchema, with a page size cap, response latency, injected 503s
+    (with Retry-After) and ETags, counting the requests it serves.
+    """
+
+    def __init__(self, schema: StubSchema, host: str = "127.0.0.1", port: int = 0, max_page_size: int = 1000,
+                 latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0):
+        self.schema = schema
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = StubServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def __enter__(self) -> "StubAPI":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> "StubAPI":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.failures = 0
+
+    def respond(self, path: str, query: Dict[str, str]) -> tuple[int, Dict | None]:
+        parts = [part for part in path.split("/") if part]
+        if parts == ["api"]:
+            return 200, {table: f"{self.base_url}{table}/" for table in self.schema.schema}
+        if len(parts) != 2 or parts[1] not in self.schema.schema:
+            return 404, {"detail": "Not found."}
+
+        table = parts[1]
+        page = int(query.pop("page", 1))
+        page_size = min(int(query.pop("page_size", 100)), self.max_page_size)
+        filters = {key[:-len("__gt")]: value for key, value in query.items() if key.endswith("__gt")}
+        results, count = self.schema.rows(table, (page - 1) * page_size, page * page_size, filters)
+        if page > 1 and not results:
+            return 404, {"detail": "Invalid page."}
+
+        links = {"next": None, "previous": None}
+        extra = "".join(f"&{key}__gt={value}" for key, value in filters.items())
+        if page * page_size < count:
+            links["next"] = f"{self.base_url}{table}/?page={page + 1}&page_size={page_size}{extra}"
+        if page > 1:
+            links["previous"] = f"{self.base_url}{table}/?page={page - 1}&page_size={page_size}{extra}"
+        spec = self.schema.schema[table]
+        return 200, {
+            "count": count,
+            "links": links,
+            "results": results,
+            "metadata": {
+                "fields": {field: {"type": "string"} for field in spec["fields"]},
+                "foreign_keys": dict(spec["foreign_keys"]),
+            },
+        }
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status: int, body: bytes = b"", headers: Dict[str, str] = None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with api.lock:
+                    api.requests += 1
+                if api.latency or api.jitter:
+                    time.sleep(api.latency + random.uniform(0, api.jitter))
+                if api.failure_rate and random.random() < api.failure_rate:
+                    with api.lock:
+                        api.failures += 1
+                    self.send(503, headers={"Retry-After": "0"})
+                    return
+
+                url = urlparse(self.path)
+                status, body = api.respond(url.path, dict(parse_qsl(url.query)))
+                data = json.dumps(body).encode()
+                etag = f'"{hashlib.md5(data).hexdigest()}"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send(304, headers={"ETag": etag})
+                    return
+                self.send(status, data, {"Content-Type": "application/json", "ETag": etag})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub of the Globalise API with synthetic tables")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument("-r", "--rows", type=int, default=1000, help="Rows of the location table")
+    parser.add_argument("--max-page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds, up to this much")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    api = StubAPI(StubSchema(args.rows), args.host, args.port, args.max_page_size, args.latency, args.jitter,
+                  args.failure_rate)
+    print(f"Serving {api.schema.counts} on {api.base_url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        api.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from FetchAPIWithPageOperator.watermarks import load_watermarks, save_watermarks
+
+RUN = {"table_name": "Place", "distance": 1, "baseURL": "http://api", "outputFormat": "nt"}
+
+
+def test_tasks_keep_their_own_watermarks(tmp_path):
+    state_file = str(tmp_path / "watermarks.json")
+    save_watermarks(state_file, "dag_a.fetch", RUN, {"Place": {"field": "modified", "value": "2024-01-01"}})
+    save_watermarks(state_file, "dag_b.fetch", RUN, {"Place": {"field": "modified", "value": "2023-01-01"}})
+    assert load_watermarks(state_file, "dag_a.fetch", RUN)["Place"]["value"] == "2024-01-01"
+    assert load_watermarks(state_file, "dag_b.fetch", RUN)["Place"]["value"] == "2023-01-01"
+
+
+def test_older_run_finishing_last_does_not_roll_back(tmp_path):
+    state_file = str(tmp_path / "watermarks.json")
+    save_watermarks(state_file, "dag.fetch", RUN, {"Place": {"field": "modified", "value": "2024-06-01"},
+                                                    "Person": {"field": "id", "value": 10}})
+    save_watermarks(state_file, "dag.fetch", RUN, {"Place": {"field": "modified", "value": "2024-01-01"}})
+    assert load_watermarks(state_file, "dag.fetch", RUN) == {"Place": {"field": "modified", "value": "2024-06-01"},
+                                                             "Person": {"field": "id", "value": 10}}
+
+
+def test_watermarks_of_another_run_are_ignored(tmp_path):
+    state_file = str(tmp_path / "watermarks.json")
+    save_watermarks(state_file, "dag.fetch", RUN, {"Place": {"field": "id", "value": 5}})
+    assert load_watermarks(state_file, "dag.fetch", dict(RUN, distance=2)) == {}
+    # no temporary file is left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["watermarks.json", "watermarks.json.lock"]
@@ -0,0 +1,111 @@
+import os
+import json
+import fcntl
+import logging
+import contextlib
+from typing import Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+
+def read_state(file_path: str) -> Dict:
+    if not file_path or not os.path.isfile(file_path):
+        return {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@contextlib.contextmanager
+def locked(file_path: str):
+    """Exclusive lock on the state file, held by one writer across processes and threads"""
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(f"{file_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_watermarks(file_path: str, key: str, run: Dict) -> Dict:
+    """
+    Per-table high-water marks of the previous run of a task, stored under its key, e.g. its DAG and task ID.
+    Marks recorded for a different start table, distance or API are ignored.
+    """
+    state = read_state(file_path).get(key, {})
+    if not state:
+        return {}
+    if state.get("run") != run:
+        logger.info(f"Watermarks of {key} in {file_path} belong to another run ({state.get('run')}), ignoring them")
+        return {}
+    return state.get("tables", {})
+
+
+def save_watermarks(file_path: str, key: str, run: Dict, watermarks: Dict) -> None:
+    with locked(file_path):
+        state = read_state(file_path)
+        previous = state.get(key, {})
+        tables = dict(previous.get("tables", {})) if previous.get("run") == run else {}
+        for table, watermark in watermarks.items():
+            current = tables.get(table)
+            # a run finishing after a later one does not roll the marks back
+            if current and current["field"] == watermark["field"] and not _is_newer(watermark["value"],
+                                                                                    current["value"]):
+                continue
+            tables[table] = watermark
+        state[key] = {"run": run, "tables": tables}
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, file_path)
+    logger.info(f"Watermarks of {key} saved to {file_path}")
+
+
+def get_watermark_field(fields: Dict, candidates: List[str]) -> str | None:
+    """First candidate field (e.g. a modified timestamp) the table has, falling back to its id"""
+    for field in candidates:
+        if field in fields:
+            return field
+    return "id" if "id" in fields else None
+
+
+def _is_newer(value: Any, watermark: Any) -> bool:
+    if value is None:
+        return False
+    if type(value) is not type(watermark):
+        return str(value) > str(watermark)
+    return value > watermark
+
+
+def newer_records(records: List[Dict], field: str, watermark: Any) -> List[Dict]:
+    # the API filter may be unsupported, so the records are checked again here
+    return [record for record in records if _is_newer(record.get(field), watermark)]
+
+
+def max_watermark(records: List[Dict], field: str, watermark: Any = None) -> Any:
+    for record in records:
+        value = record.get(field)
+        if watermark is None or _is_newer(value, watermark):
+            watermark = value
+    return watermark
+
+
+def patch_graph(previous_json_ld: Dict, json_ld: Dict) -> Dict:
+    """Replace the changed records of the previous JSON-LD output by @id, and append the new ones"""
+    graph = previous_json_ld.get("@graph", [])
+    positions = {node["@id"]: position for position, node in enumerate(graph)}
+    replaced = 0
+    for node in json_ld["@graph"]:
+        position = positions.get(node["@id"])
+        if position is None:
+            positions[node["@id"]] = len(graph)
+            graph.append(node)
+        else:
+            graph[position] = node
+            replaced += 1
+    logger.info(f"Patched previous output: {replaced} records replaced, "
+                f"{len(json_ld['@graph']) - replaced} records added")
+
+    context = previous_json_ld.get("@context", {})
+    context.update(json_ld["@context"])
+    return {"@context": context, "@graph": graph}
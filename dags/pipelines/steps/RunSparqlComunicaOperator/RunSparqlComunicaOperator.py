@@ -1,10 +1,16 @@
 import os
+import json
 import logging
+import functools
+import importlib.metadata
 import httpx
-import tempfile
 import subprocess
 import shutil
 from airflow.models import BaseOperator
+from .query_worker import get_worker
+from .local_engine import ENGINES, run_query, construct_per_row
+from .result_cache import get_cache
+from utils import MessageQueue, iter_message_queue
 
 
 def create_uri_from_file(file_path: str, input_data: dict) -> str | None:
@@ -15,12 +21,54 @@ def create_uri_from_file(file_path: str, input_data: dict) -> str | None:
     return None
 
 
+@functools.lru_cache(maxsize=64)
+def download_query(url: str) -> str:
+    """Text of a query URL, downloaded once per task process"""
+    response = httpx.get(url)
+    response.raise_for_status()
+    return response.text
+
+
+@functools.lru_cache(maxsize=None)
+def get_node_dir(nvm_dir: str = "/home/airflow/.nvm/versions/node") -> str | None:
+    """Directory of the newest Node.js version installed with NVM, the one queries run on"""
+    node_versions = [d for d in os.listdir(nvm_dir) if d.startswith("v")] if os.path.isdir(nvm_dir) else []
+    if not node_versions:
+        return None
+    # compared as numbers, v9 is older than v18
+    newest = max(node_versions, key=lambda d: tuple(int(part) if part.isdigit() else 0
+                                                     for part in d.lstrip("v").split(".")))
+    return os.path.join(nvm_dir, newest)
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine_version(engine: str) -> str:
+    """Engine and version, part of the result cache key so an upgrade does not reuse old results"""
+    if engine != "comunica":
+        return f"{engine} {importlib.metadata.version(engine)}"
+    node_dir = get_node_dir()
+    package = f"{node_dir}/lib/node_modules/@comunica/query-sparql/package.json"
+    if node_dir and os.path.isfile(package):
+        with open(package, "r", encoding="utf-8") as f:
+            return f"comunica {json.load(f)['version']}"
+    logging.getLogger(__name__).warning("Comunica version not found, an upgrade will not invalidate cached results")
+    return "comunica"
+
+
+def resolve_local_file(file_path: str, input_data: dict) -> str | None:
+    """Local path of a `file_uri:<key>` reference to a file of the previous sub-task"""
+    return input_data.get(file_path.split(":", 1)[1], None)
+
+
 
 
 
 class RunSparqlComunicaOperator(BaseOperator):
     def __init__(self, docker_image: str, docker_network: str, docker_rdf_file: str, docker_output_format: str,
-                 query: str, output_store: str = None, output_trace: str = None, **kwargs):
+                 query: str, output_store: str = None, output_trace: str = None, worker: bool = True,
+                 query_timeout: float | None = 600, engine: str = "comunica", batch: bool = False,
+                 message_queue: str | None = None, output_queue: str | None = None, cache_dir: str | None = None,
+                 cache_max_bytes: int = 1024 ** 3, local_sources: bool = False, **kwargs):
         super().__init__(**kwargs)
         self.docker_image = docker_image
         self.docker_network = docker_network
@@ -29,85 +77,239 @@ class RunSparqlComunicaOperator(BaseOperator):
         self.query = query
         self.output_store = output_store
         self.output_trace = output_trace
+        # run queries in a Comunica worker started once per task, instead of a comunica-sparql process per query
+        self.worker = worker
+        self.query_timeout = query_timeout
+        # "rdflib" or "pyoxigraph" run the query in this process against a store loaded with the row's file
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        self.engine = engine
+        # run the query of every row in message_queue in one pass, and queue the row results in output_queue
+        if batch and (engine != "rdflib" or not message_queue or not output_queue):
+            raise ValueError("batch needs engine 'rdflib', a message_queue and an output_queue")
+        self.batch = batch
+        self.message_queue = message_queue
+        self.output_queue = output_queue
+        # results of queries on local files are kept here and reused while query, input and engine are unchanged
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        # give Comunica the row's files from the local disk instead of their util-server URLs
+        self.local_sources = local_sources
         self.logger = logging.getLogger(__name__)
 
-    def add_node_to_path(self, env, nvm_dir: str = "/home/airflow/.nvm/versions/node"):
-        node_versions = sorted([d for d in os.listdir(nvm_dir) if d.startswith("v")], reverse=True)
-        if not node_versions:
+    def add_node_to_path(self, env):
+        node_dir = get_node_dir()
+        if not node_dir:
             raise RuntimeError("No Node.js version found in NVM directory")
-        for node in node_versions:
-            node_version = node.lstrip("v")
-            node_path = f"{nvm_dir}/v{node_version}/bin"
-            env["PATH"] = f"{node_path}:" + env["PATH"]
-            self.logger.info(f"Adding Node.js version: {node_version} to PATH; PATH: {env['PATH']}")
+        env["PATH"] = f"{node_dir}/bin:" + env["PATH"]
+        # globally installed packages, for the query worker to load Comunica from
+        env["NODE_PATH"] = f"{node_dir}/lib/node_modules:" + env.get("NODE_PATH", "")
+        self.logger.info(f"Adding Node.js {os.path.basename(node_dir)} to PATH; PATH: {env['PATH']}")
         return env
 
-    def execute(self, context):
-        self.logger.info("Running SPARQL query ...")
-        input_data = context['ti'].xcom_pull(task_ids=None, key='previous_output')
-        self.logger.debug(f"Input data: {input_data}")
+    def run_in_worker(self, query: str, sources: list) -> str:
+        """Run a query in the query worker of this process"""
+        self.logger.info(f"Querying {sources} in the query worker")
+        worker = get_worker(lambda: self.add_node_to_path(os.environ.copy()))
+        try:
+            return worker.query(query, sources, self.docker_output_format, timeout=self.query_timeout)
+        except RuntimeError as e:
+            self.logger.error(f"Error while running SPARQL query: {e}")
+            raise RuntimeError(f"SPARQL query execution failed: {e}")
+
+    def get_local_source(self, input_data) -> str:
+        if self.docker_rdf_file.startswith("file_uri:"):
+            return resolve_local_file(self.docker_rdf_file, input_data) or self.docker_rdf_file
+        return self.docker_rdf_file
+
+    def get_query_text(self, input_data, local: bool = True) -> str:
+        if os.path.isfile(self.query):
+            with open(self.query, "r", encoding="utf-8") as f:
+                return f.read()
+        if self.query.startswith("file_uri:"):
+            if local:
+                with open(resolve_local_file(self.query, input_data), "r", encoding="utf-8") as f:
+                    return f.read()
+            # a file of this row, published on util-server
+            file_uri = create_uri_from_file(self.query, input_data)
+            self.logger.debug(f"Using file URI: {file_uri}")
+            response = httpx.get(file_uri)
+            response.raise_for_status()
+            return response.text
+        if self.query.startswith("http://") or self.query.startswith("https://"):
+            return download_query(self.query)
+        return self.query
+
+    def run_local(self, input_data) -> str:
+        """Run the query in this process, with the row's files read from the local disk"""
+        source = self.get_local_source(input_data)
+        self.logger.info(f"Querying {source} with {self.engine}")
+        return run_query(self.engine, self.get_query_text(input_data), [source], self.docker_output_format)
 
+    def run_comunica(self, input_data) -> str:
+        # rdf file
+        source = self.docker_rdf_file
+        local_file = None
+        if source.startswith("file_uri:"):
+            if self.local_sources:
+                local_file = resolve_local_file(source, input_data)
+            else:
+                source = create_uri_from_file(source, input_data) or source
+        query = self.get_query_text(input_data, local=self.local_sources)
+
+        if self.worker:
+            # the worker reads local files itself and hands them to Comunica as serialized sources
+            return self.run_in_worker(query, [{"file": local_file} if local_file else source])
+
+        if local_file:
+            self.logger.warning("comunica-sparql cannot read local files, querying the util-server URL")
+            source = create_uri_from_file(source, input_data) or source
         command = [
             "comunica-sparql",
         ]
-        # rdf file
-        if self.docker_rdf_file.startswith("file_uri:"):
-            self.docker_rdf_file = create_uri_from_file(self.docker_rdf_file, input_data) or self.docker_rdf_file
-        command.extend([self.docker_rdf_file])
-
+        command.extend([source])
         # sparql query
         if os.path.isfile(self.query):
             command.extend(["-f", self.query])
-        elif self.query.startswith("http://") or self.query.startswith("https://") or self.query.startswith("file_uri:"):
-            if self.query.startswith("file_uri:"):
-                file_uri = create_uri_from_file(self.query, input_data)
-                self.query = file_uri if file_uri else self.query
-            self.logger.debug(f"Using file URI: {self.query}")
-            # download the file
-            with httpx.Client() as client:
-                response = client.get(self.query)
-                response.raise_for_status()
-                with tempfile.NamedTemporaryFile(delete=False, mode="w", encoding="utf-8",
-                                                 suffix=".sparql") as tmp_file:
-                    tmp_file.write(response.text)
-                    tmp_file_path = tmp_file.name
-            command.extend(["-f", tmp_file_path])
         else:
-            command.extend(["-q", self.query])
-
+            command.extend(["-q", query])
         if self.docker_output_format:
             command.extend(["-t", self.docker_output_format])
 
         self.logger.info(f"Executing command: {' '.join(command)}")
-
         try:
             env = os.environ.copy()
             env = self.add_node_to_path(env)
             self.logger.debug(os.listdir("/tmp"))  # Ensure /tmp is accessible
             result = subprocess.run(command, capture_output=True, text=True, check=True, env=env)
-            output = result.stdout
+            return result.stdout
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Error while running SPARQL query: {e.stderr}")
+            raise RuntimeError(f"SPARQL query execution failed: {e.stderr}")
+
+    def get_cache_key(self, input_data) -> str | None:
+        """Key of the result in the cache, if the input is a local file"""
+        source = self.get_local_source(input_data or {})
+        if not os.path.isfile(source):
+            return None
+        with open(source, "rb") as f:
+            data = f.read()
+        return get_cache(self.cache_dir, self.cache_max_bytes).key(
+            self.get_query_text(input_data), data, self.docker_output_format or "", get_engine_version(self.engine))
+
+    def cached_result(self, path: str, name: str) -> dict:
+        """Result of a cached output, copied to where store_output would have written it"""
+        result = {}
+        if self.output_trace:
+            with open(path, "r", encoding="utf-8") as f:
+                result["result"] = f.read()
+        if self.output_store:
+            # a copy, not the cache file itself: that may be evicted, and a hard link would be truncated
+            # in the cache as well when the next run writes its output over it
+            output_file_path = f"/tmp/{name}.{self.output_store}"
+            shutil.copyfile(path, output_file_path)
+            self.logger.info(f"Output copied to {output_file_path}")
+            result[self.output_store] = output_file_path
+        return result
+
+    def count_cache_result(self, context, hit: bool) -> None:
+        """
+        Count a cache hit or miss: a row adds it to its counters, summed by CSVIteratorOperator over all rows
+        of the task, a task of its own logs it as its summary
+        """
+        if context.get("row_number") is None:
+            self.logger.info(f"Result cache {self.cache_dir}: {int(hit)} hits, {int(not hit)} misses")
+            return
+        counter = "sparql_cache_hits" if hit else "sparql_cache_misses"
+        stats = context["ti"].xcom_pull(task_ids=None, key="stats") or {}
+        stats[counter] = stats.get(counter, 0) + 1
+        context["ti"].xcom_push(key="stats", value=stats)
+
+    def execute(self, context):
+        self.logger.info("Running SPARQL query ...")
+        if self.batch:
+            return self.execute_batch(context)
+        input_data = context['ti'].xcom_pull(task_ids=None, key='previous_output')
+        self.logger.debug(f"Input data: {input_data}")
+
+        cache = get_cache(self.cache_dir, self.cache_max_bytes) if self.cache_dir else None
+        cache_key = self.get_cache_key(input_data) if cache else None
+        cached = cache.get(cache_key) if cache_key else None
+        if cache_key:
+            self.count_cache_result(context, bool(cached))
+        if cached:
+            self.logger.info(f"Result found in cache: {cached}")
+            result = self.cached_result(cached, self.task_id)
+        else:
+            if self.engine == "comunica":
+                output = self.run_comunica(input_data)
+            else:
+                output = self.run_local(input_data)
             self.logger.info("SPARQL query executed successfully.")
             self.logger.debug(f"Query output: {output}")
 
-            # prepare return result
-            result = {}
-
-            # add output content to output trace if configured
-            if self.output_trace:
-                result["result"] = output
-
-            # save output to file if configured
-            if self.output_store:
-                output_file_path = f"/tmp/{self.task_id}.{self.output_store}"
-                with open(output_file_path, "w", encoding="utf-8") as f:
-                    f.write(output)
-                self.logger.info(f"Output saved to {output_file_path}")
-                result[self.output_store] = output_file_path
-
-            # push result to XCom
-            if self.output_trace:
-                context["ti"].xcom_push("previous_output", result)
-            return result
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"Error while running SPARQL query: {e.stderr}")
-            raise RuntimeError(f"SPARQL query execution failed: {e.stderr}")
\ No newline at end of file
+            result = self.store_output(output, self.task_id)
+            if cache_key:
+                cache.put(cache_key, output)
+                self.logger.info("Result added to cache")
+
+        # push result to XCom
+        if self.output_trace:
+            context["ti"].xcom_push("previous_output", result)
+        return result
+
+    def store_output(self, output: str, name: str) -> dict:
+        # prepare return result
+        result = {}
+
+        # add output content to output trace if configured
+        if self.output_trace:
+            result["result"] = output
+
+        # save output to file if configured
+        if self.output_store:
+            output_file_path = f"/tmp/{name}.{self.output_store}"
+            with open(output_file_path, "w", encoding="utf-8") as f:
+                f.write(output)
+            self.logger.info(f"Output saved to {output_file_path}")
+            result[self.output_store] = output_file_path
+        return result
+
+    def execute_batch(self, context):
+        """
+        Query all rows collected in message_queue at once: rows sharing a query text are evaluated together
+        over one store, each row in its own named graph, and their results are queued in row order as the
+        per-row operator would have returned them.
+        """
+        input_data = context['ti'].xcom_pull(task_ids=None, key=self.message_queue)
+        # rows grouped by query text, the same for all rows unless it comes from a file per row
+        groups: dict[str, dict[int, list[str]]] = {}
+        shared_query = None if self.query.startswith("file_uri:") else self.get_query_text({})
+        cache = get_cache(self.cache_dir, self.cache_max_bytes) if self.cache_dir else None
+        cache_keys, cached = {}, {}
+        for row_number, item in enumerate(iter_message_queue(input_data), start=1):
+            cache_keys[row_number] = self.get_cache_key(item) if cache else None
+            cached[row_number] = cache.get(cache_keys[row_number]) if cache_keys[row_number] else None
+            if cached[row_number]:
+                continue
+            query = shared_query or self.get_query_text(item)
+            groups.setdefault(query, {})[row_number] = [self.get_local_source(item)]
+        outputs = {}
+        for query, rows in groups.items():
+            outputs.update(construct_per_row(query, rows))
+        self.logger.info(f"Queried {len(outputs)} rows in {len(groups)} passes")
+        if cache:
+            hits = sum(1 for path in cached.values() if path)
+            misses = sum(1 for row_number, key in cache_keys.items() if key and not cached[row_number])
+            self.logger.info(f"Result cache {self.cache_dir}: {hits} hits, {misses} misses")
+
+        queue = MessageQueue.for_run(self.output_queue, context["run_id"], truncate=True)
+        for row_number in sorted(cached):
+            if cached[row_number]:
+                queue.append(self.cached_result(cached[row_number], f"{self.task_id}_row_{row_number}"))
+                continue
+            queue.append(self.store_output(outputs[row_number], f"{self.task_id}_row_{row_number}"))
+            if cache_keys[row_number]:
+                cache.put(cache_keys[row_number], outputs[row_number])
+        context["ti"].xcom_push(key=self.output_queue, value=queue.handle())
+        return {"rows": len(cached), "passes": len(groups), "message_queue": self.output_queue}
@@ -0,0 +1,108 @@
+// Long-lived Comunica query worker for RunSparqlComunicaOperator.
+// Reads one JSON request per line on stdin: {"id", "query", "sources", "mediaType"}, {"id", "ping": true}
+// or {"id", "cancel": true} to stop a query the caller gave up on,
+// where a source is a URL or {"file": path} for a local RDF file,
+// and writes one JSON response per line on stdout: {"id", "result"} or {"id", "error"},
+// or {"id", "cancelled": true} once a cancelled query has stopped.
+// Requests are answered as they finish, so several can run at the same time.
+const fs = require("fs");
+const path = require("path");
+const readline = require("readline");
+const { QueryEngine } = require("@comunica/query-sparql");
+
+const engine = new QueryEngine();
+// running queries by ID: whether they were cancelled, and their result stream once it is there
+const running = new Map();
+
+async function streamToString(stream) {
+  const chunks = [];
+  for await (const chunk of stream) {
+    chunks.push(typeof chunk === "string" ? chunk : chunk.toString());
+  }
+  return chunks.join("");
+}
+
+const MEDIA_TYPES = {
+  ".ttl": "text/turtle", ".nt": "application/n-triples", ".nq": "application/n-quads", ".trig": "application/trig",
+  ".n3": "text/n3", ".jsonld": "application/ld+json", ".rdf": "application/rdf+xml", ".owl": "application/rdf+xml",
+};
+
+// local files are read here and passed as serialized sources, without an HTTP server in between
+function toSource(source) {
+  if (typeof source === "string") {
+    return source;
+  }
+  const filePath = path.resolve(source.file);
+  return {
+    type: "serialized",
+    value: fs.readFileSync(filePath, "utf8"),
+    mediaType: MEDIA_TYPES[path.extname(filePath).toLowerCase()] || "text/turtle",
+    baseIRI: `file://${filePath}`,
+  };
+}
+
+function send(response) {
+  process.stdout.write(JSON.stringify(response) + "\n");
+}
+
+async function runQuery(request, task) {
+  const result = await engine.query(request.query, { sources: request.sources.map(toSource) });
+  // results are only produced while they are serialized, so a query cancelled by now does no more work
+  if (task.cancelled) {
+    return { id: request.id, cancelled: true };
+  }
+  const { data } = await engine.resultToString(result, request.mediaType || undefined);
+  task.stream = data;
+  const output = await streamToString(data);
+  return task.cancelled ? { id: request.id, cancelled: true } : { id: request.id, result: output };
+}
+
+async function handle(request) {
+  if (request.ping) {
+    return { id: request.id, pong: true };
+  }
+  const task = { cancelled: false, stream: null };
+  running.set(request.id, task);
+  try {
+    return await runQuery(request, task);
+  } catch (error) {
+    if (task.cancelled) {
+      return { id: request.id, cancelled: true };
+    }
+    return { id: request.id, error: String((error && error.message) || error) };
+  } finally {
+    running.delete(request.id);
+  }
+}
+
+function cancel(id) {
+  const task = running.get(id);
+  if (!task) {
+    // already answered
+    send({ id, cancelled: true });
+    return;
+  }
+  task.cancelled = true;
+  // destroying the result stream stops pulling bindings from the engine
+  if (task.stream) {
+    task.stream.destroy();
+  }
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+lines.on("line", (line) => {
+  let request;
+  try {
+    request = JSON.parse(line);
+  } catch (error) {
+    process.stderr.write(`Invalid request: ${line}\n`);
+    return;
+  }
+  if (request.cancel) {
+    cancel(request.id);
+    return;
+  }
+  handle(request).then(send);
+});
+lines.on("close", () => process.exit(0));
+send({ ready: true });
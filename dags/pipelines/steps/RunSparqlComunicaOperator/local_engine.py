@@ -0,0 +1,231 @@
+import os
+import io
+import csv
+import logging
+import functools
+import collections
+import httpx
+from typing import Iterator
+from rdflib import Graph, Dataset, URIRef, BNode, Literal, Variable
+from rdflib.namespace import RDF, XSD
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.algebra import traverse
+# construct_per_row evaluates the query pattern itself on these, rdflib is pinned below 8 for them
+from rdflib.plugins.sparql.sparql import QueryContext
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.evaluate import evalPart
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("comunica", "rdflib", "pyoxigraph")
+
+RDF_FORMATS = {".ttl": "turtle", ".nt": "nt", ".nq": "nquads", ".trig": "trig", ".rdf": "xml", ".owl": "xml",
+               ".jsonld": "json-ld", ".json": "json-ld", ".n3": "n3"}
+# rdflib serializers for the media types that are not written like Comunica does below
+RDFLIB_MEDIA_TYPES = {"application/n-triples": "nt", "application/n-quads": "nquads", "application/trig": "trig",
+                      "application/rdf+xml": "xml", "application/ld+json": "json-ld",
+                      "application/sparql-results+json": "json", "application/sparql-results+xml": "xml",
+                      "application/json": "json"}
+
+
+@functools.lru_cache(maxsize=128)
+def prepare_query(query: str):
+    """Parsed and algebra-translated query, shared by all rows running the same query text"""
+    logger.info("Parsing SPARQL query")
+    return prepareQuery(query)
+
+
+def read_source(source: str) -> tuple[bytes, str]:
+    """Content and rdflib format of an RDF source, a local file or an HTTP URL"""
+    if source.startswith("http://") or source.startswith("https://"):
+        response = httpx.get(source)
+        response.raise_for_status()
+        data = response.content
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    path = httpx.URL(source).path if "://" in source else source
+    return data, RDF_FORMATS.get(os.path.splitext(path)[1].lower(), "turtle")
+
+
+# terms as (kind, value, datatype, language), from rdflib or pyoxigraph
+def rdflib_term(term) -> tuple | None:
+    if term is None:
+        return None
+    if isinstance(term, Literal):
+        return "literal", str(term), str(term.datatype) if term.datatype else None, term.language
+    return ("bnode" if isinstance(term, BNode) else "iri"), str(term), None, None
+
+
+def oxigraph_term(term) -> tuple | None:
+    if term is None:
+        return None
+    kind = type(term).__name__
+    if kind == "Literal":
+        return "literal", term.value, term.datatype.value if term.datatype else None, term.language
+    return ("bnode" if kind == "BlankNode" else "iri"), term.value, None, None
+
+
+ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+
+
+def encode_term(term: tuple) -> str:
+    kind, value, datatype, language = term
+    if kind == "iri":
+        return f"<{value}>"
+    if kind == "bnode":
+        return f"_:{value}"
+    literal = '"' + "".join(ESCAPES.get(char, char) for char in value) + '"'
+    if language:
+        return f"{literal}@{language}"
+    if datatype and datatype != str(XSD.string):
+        return f"{literal}^^<{datatype}>"
+    return literal
+
+
+def write_turtle(triples) -> str:
+    """
+    Triples written as Comunica writes text/turtle: full IRIs, one subject per statement, `a` for rdf:type.
+    Each subject starts with its types, so the `<subject> a <type>` line SplitGraphOperator looks for is there.
+    """
+    rdf_type = str(RDF.type)
+    triples = sorted(triples, key=lambda t: (t[0][1], t[1][1] != rdf_type, t[1][1], t[2][1]))
+    out, subject = io.StringIO(), None
+    for s, p, o in triples:
+        predicate = "a" if p[1] == rdf_type else encode_term(p)
+        if s != subject:
+            out.write(("" if subject is None else ".\n") + f"{encode_term(s)} {predicate} {encode_term(o)}")
+            subject = s
+        else:
+            out.write(f";\n    {predicate} {encode_term(o)}")
+    if subject is not None:
+        out.write(".\n")
+    return out.getvalue()
+
+
+def write_csv(variables: list[str], rows) -> str:
+    """Bindings written as Comunica writes text/csv: plain values, blank nodes as _:id, CRLF line ends"""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\r\n")
+    writer.writerow(variables)
+    for row in rows:
+        writer.writerow(["" if term is None else f"_:{term[1]}" if term[0] == "bnode" else term[1] for term in row])
+    return out.getvalue()
+
+
+def query_rdflib(query: str, sources: list[str], media_type: str | None) -> str:
+    graph = Graph()
+    for source in sources:
+        data, rdf_format = read_source(source)
+        graph.parse(data=data, format=rdf_format)
+    result = graph.query(prepare_query(query))
+    if media_type in RDFLIB_MEDIA_TYPES:
+        serialized = result.serialize(format=RDFLIB_MEDIA_TYPES[media_type])
+        return serialized.decode("utf-8") if isinstance(serialized, bytes) else serialized
+    if result.type in ("CONSTRUCT", "DESCRIBE"):
+        if media_type not in (None, "text/turtle"):
+            raise ValueError(f"Output format {media_type} is not supported for {result.type} queries")
+        return write_turtle(tuple(rdflib_term(term) for term in triple) for triple in result.graph)
+    if result.type == "SELECT" and media_type == "text/csv":
+        variables = [str(var) for var in result.vars]
+        return write_csv(variables, ([rdflib_term(row[var]) for var in result.vars] for row in result))
+    raise ValueError(f"Output format {media_type} is not supported for {result.type} queries")
+
+
+def query_pyoxigraph(query: str, sources: list[str], media_type: str | None) -> str:
+    try:
+        import pyoxigraph
+    except ImportError:
+        raise ImportError("The pyoxigraph engine needs the pyoxigraph package: pip install pyoxigraph")
+    oxigraph_formats = {"turtle": pyoxigraph.RdfFormat.TURTLE, "nt": pyoxigraph.RdfFormat.N_TRIPLES,
+                        "nquads": pyoxigraph.RdfFormat.N_QUADS, "trig": pyoxigraph.RdfFormat.TRIG,
+                        "xml": pyoxigraph.RdfFormat.RDF_XML, "n3": pyoxigraph.RdfFormat.N3}
+    store = pyoxigraph.Store()
+    for source in sources:
+        data, rdf_format = read_source(source)
+        if rdf_format not in oxigraph_formats:
+            raise ValueError(f"Source {source} is not in a format pyoxigraph reads")
+        store.load(data, format=oxigraph_formats[rdf_format])
+    result = store.query(query)
+    if isinstance(result, pyoxigraph.QueryTriples):
+        if media_type not in (None, "text/turtle"):
+            raise ValueError(f"Output format {media_type} is not supported for graph results")
+        return write_turtle(tuple(oxigraph_term(term) for term in (t.subject, t.predicate, t.object))
+                            for t in result)
+    if isinstance(result, pyoxigraph.QuerySolutions) and media_type == "text/csv":
+        variables = [var.value for var in result.variables]
+        return write_csv(variables, ([oxigraph_term(solution[var]) for var in variables] for solution in result))
+    raise ValueError(f"Output format {media_type} is not supported for {type(result).__name__}")
+
+
+@functools.lru_cache(maxsize=128)
+def prepare_batch_query(query: str):
+    """
+    Parsed query for construct_per_row: a CONSTRUCT query that only reads the default graph, as a query
+    run on a single row does. GRAPH, SERVICE and FROM would reach past the graph of the row in the batch store.
+    """
+    prepared = prepare_query(query)
+    if prepared.algebra.name != "ConstructQuery":
+        raise ValueError(f"Batch queries must be CONSTRUCT queries, not {prepared.algebra.name}")
+    if prepared.algebra.get("datasetClause"):
+        raise ValueError("Batch queries cannot have FROM or FROM NAMED clauses")
+    names = set()
+    traverse(prepared.algebra, visitPre=lambda node: names.add(getattr(node, "name", None)))
+    for name, keyword in (("Graph", "GRAPH"), ("ServiceGraphPattern", "SERVICE")):
+        if name in names:
+            raise ValueError(f"Batch queries cannot use {keyword} patterns")
+    # a CONSTRUCT WHERE query has its template in the pattern
+    if not prepared.algebra.template and prepared.algebra.p.p.name != "BGP":
+        raise ValueError("A batch CONSTRUCT WHERE query must be a single basic graph pattern")
+    return prepared
+
+
+def fill_template(template, solution) -> Iterator[tuple]:
+    """Triples of a CONSTRUCT template for one solution, leaving out triples with unbound or invalid terms"""
+    # fresh blank nodes for every solution
+    bnodes = collections.defaultdict(BNode)
+    for triple in template:
+        s, p, o = (bnodes[term] if isinstance(term, BNode) else solution.get(term) if isinstance(term, Variable)
+                   else term for term in triple)
+        if s is None or o is None or isinstance(s, Literal) or not isinstance(p, URIRef):
+            continue
+        yield s, p, o
+
+
+def construct_per_row(query: str, rows: dict[int, list[str]]) -> dict[int, str]:
+    """
+    text/turtle result of a CONSTRUCT query for many rows in one evaluation. The sources of every row are
+    loaded into a named graph of one store and the query pattern is wrapped in GRAPH ?row, so it only matches
+    within a row, as if run on the row alone, and the triples it constructs are split back per row.
+    """
+    prepared = prepare_batch_query(query)
+    dataset = Dataset()
+    row_graphs: dict[URIRef, int] = {}
+    for row_number, sources in rows.items():
+        graph = dataset.graph(URIRef(f"urn:row:{row_number}"))
+        row_graphs[graph.identifier] = row_number
+        for source in sources:
+            data, rdf_format = read_source(source)
+            graph.parse(data=data, format=rdf_format)
+
+    row = Variable("__row")
+    template = prepared.algebra.template or prepared.algebra.p.p.triples
+    ctx = QueryContext(dataset, initBindings={})
+    ctx.prologue = prepared.prologue
+    triples: dict[int, set] = {row_number: set() for row_number in rows}
+    for solution in evalPart(ctx, CompValue("Graph", term=row, p=prepared.algebra.p)):
+        # ?row also runs over graphs that are not rows, such as the default graph
+        row_number = row_graphs.get(solution.get(row))
+        if row_number is not None:
+            triples[row_number].update(fill_template(template, solution))
+    return {row_number: write_turtle(tuple(rdflib_term(term) for term in triple) for triple in row_triples)
+            for row_number, row_triples in triples.items()}
+
+
+def run_query(engine: str, query: str, sources: list[str], media_type: str | None) -> str:
+    """Run a query in this process against a store loaded with the sources, serialized as Comunica would"""
+    if engine == "rdflib":
+        return query_rdflib(query, sources, media_type)
+    if engine == "pyoxigraph":
+        return query_pyoxigraph(query, sources, media_type)
+    raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import atexit
+import logging
+import itertools
+import threading
+import subprocess
+from typing import Callable
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "comunica_worker.js")
+
+
+class WorkerDied(RuntimeError):
+    pass
+
+
+class WorkerProcess:
+    """
+    One started comunica_worker.js and the requests sent to it. Each process keeps its own, so a late exit
+    of a replaced process cannot fail the requests of the next one.
+    """
+
+    def __init__(self, process: subprocess.Popen):
+        self.process = process
+        self.pending: dict[int, Future] = {}
+        # timed-out requests the worker was asked to stop, until it reports them stopped
+        self.cancelled: set[int] = set()
+        self.last_response = time.monotonic()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def write(self, request: dict) -> None:
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise WorkerDied(f"Query worker is not accepting requests: {e}")
+
+    def fail_pending(self, error: Exception) -> None:
+        for request_id in list(self.pending):
+            future = self.pending.pop(request_id, None)
+            if future and not future.done():
+                future.set_exception(error)
+
+
+class QueryWorker:
+    """
+    A Node.js process running comunica_worker.js, which loads the Comunica engine once and answers queries
+    sent as JSON lines on stdin. Queries from several threads are matched to their answers by ID.
+    A query that times out is stopped in the worker; a worker that crashed, fails its health check or has
+    more than max_cancelled stopped queries that keep running is started again.
+    """
+
+    def __init__(self, env: dict, startup_timeout: float = 60, health_interval: float = 30, max_cancelled: int = 4):
+        self.env = env
+        self.startup_timeout = startup_timeout
+        # an idle worker is pinged before it gets the next query
+        self.health_interval = health_interval
+        self.max_cancelled = max_cancelled
+        self.current: WorkerProcess | None = None
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.stderr = deque(maxlen=50)
+
+    def start(self) -> None:
+        self.close()
+        logger.info(f"Starting query worker {WORKER_SCRIPT}")
+        ready = Future()
+        process = subprocess.Popen(["node", WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8", env=self.env)
+        self.current = WorkerProcess(process)
+        threading.Thread(target=self.read_stdout, args=(self.current, ready), daemon=True).start()
+        threading.Thread(target=self.read_stderr, args=(process,), daemon=True).start()
+        try:
+            ready.result(timeout=self.startup_timeout)
+        except TimeoutError:
+            self.close()
+            raise WorkerDied(f"Query worker did not start within {self.startup_timeout}s")
+        logger.info(f"Query worker started, pid {process.pid}")
+
+    def read_stdout(self, worker: WorkerProcess, ready: Future) -> None:
+        for line in worker.process.stdout:
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug(f"Query worker: {line.rstrip()}")
+                continue
+            worker.last_response = time.monotonic()
+            if response.get("ready"):
+                ready.set_result(True)
+                continue
+            if response.get("cancelled"):
+                worker.cancelled.discard(response.get("id"))
+                continue
+            future = worker.pending.pop(response.get("id"), None)
+            if future is None:
+                continue
+            if "error" in response:
+                future.set_exception(RuntimeError(response["error"]))
+            else:
+                future.set_result(response.get("result"))
+        # the process is gone: fail whatever was waiting on it
+        error = WorkerDied(f"Query worker exited with {worker.process.wait()}: {''.join(self.stderr)}")
+        if not ready.done():
+            ready.set_exception(error)
+        worker.fail_pending(error)
+
+    def read_stderr(self, process: subprocess.Popen) -> None:
+        for line in process.stderr:
+            self.stderr.append(line)
+            logger.debug(f"Query worker: {line.rstrip()}")
+
+    def alive(self) -> bool:
+        return self.current is not None and self.current.alive()
+
+    def send(self, request: dict, timeout: float | None):
+        with self.lock:
+            if not self.alive():
+                self.start()
+            worker = self.current
+            request["id"] = next(self.ids)
+            future = Future()
+            worker.pending[request["id"]] = future
+            try:
+                worker.write(request)
+            except WorkerDied:
+                worker.pending.pop(request["id"], None)
+                raise
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            worker.pending.pop(request["id"], None)
+            # only this request is stopped, the others on the worker keep running
+            with self.lock:
+                worker.cancelled.add(request["id"])
+                try:
+                    worker.write({"id": request["id"], "cancel": True})
+                except WorkerDied:
+                    worker.cancelled.discard(request["id"])
+            raise
+
+    def ping(self, timeout: float = 10) -> bool:
+        try:
+            self.send({"ping": True}, timeout)
+            return True
+        except (WorkerDied, TimeoutError):
+            return False
+
+    def ensure_healthy(self) -> None:
+        worker = self.current
+        if worker is None or not worker.alive():
+            # started by the next request
+            return
+        if len(worker.cancelled) > self.max_cancelled:
+            reason = f"{len(worker.cancelled)} cancelled queries are still running"
+        elif time.monotonic() - worker.last_response < self.health_interval or self.ping():
+            return
+        else:
+            reason = "it failed its health check"
+        with self.lock:
+            # another thread may have restarted it in the meantime
+            if self.current is worker:
+                logger.warning(f"Restarting the query worker, {reason}")
+                self.start()
+
+    def query(self, query: str, sources: list[str], media_type: str | None, timeout: float | None = None) -> str:
+        """Result of a query serialized as media_type; a query whose worker dies or is restarted is sent once more"""
+        self.ensure_healthy()
+        request = {"query": query, "sources": sources, "mediaType": media_type}
+        for attempt in range(2):
+            try:
+                return self.send(dict(request), timeout)
+            except TimeoutError:
+                logger.warning(f"Query took longer than {timeout}s, cancelled it")
+                raise RuntimeError(f"SPARQL query timed out after {timeout}s")
+            except WorkerDied as e:
+                if attempt:
+                    raise
+                logger.warning(f"{e}; sending the query again")
+
+    def close(self) -> None:
+        worker, self.current = self.current, None
+        if worker is None:
+            return
+        # requests still waiting fail now, query() sends them again to the next worker
+        worker.fail_pending(WorkerDied("Query worker was stopped"))
+        if worker.alive():
+            try:
+                worker.process.stdin.close()
+                worker.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                worker.process.kill()
+
+
+# one worker per process, shared by all rows and threads of a task
+worker: QueryWorker | None = None
+worker_lock = threading.Lock()
+
+
+def get_worker(make_env: Callable[[], dict]) -> QueryWorker:
+    global worker
+    with worker_lock:
+        if worker is None:
+            worker = QueryWorker(make_env())
+            atexit.register(worker.close)
+        return worker
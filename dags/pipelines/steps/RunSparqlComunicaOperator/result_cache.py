@@ -0,0 +1,91 @@
+import os
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Query results on disk, keyed by a hash of everything that decides them: the query text, the input RDF,
+    the output format and the engine version. When the files grow past max_bytes, the least recently used
+    results are removed.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    @staticmethod
+    def key(*parts: str | bytes) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            part = part.encode("utf-8") if isinstance(part, str) else part
+            # length-prefixed, so the parts cannot run into each other
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.result")
+
+    def get(self, key: str) -> str | None:
+        """Path of the cached result, marked as used"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, output: str) -> str:
+        path = self.path(key)
+        data = output.encode("utf-8")
+        # written aside and moved, other processes may be reading the same key
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += len(data) - replaced
+            if self.size > self.max_bytes:
+                self.evict()
+        return path
+
+    def evict(self) -> None:
+        entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".result")),
+                         key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        removed = 0
+        # down to 90%, so not every new result triggers a scan
+        for entry in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            removed += 1
+        logger.info(f"Evicted {removed} results from {self.cache_dir}, {self.size} bytes left")
+
+
+caches: dict[str, ResultCache] = {}
+caches_lock = threading.Lock()
+
+
+def get_cache(cache_dir: str, max_bytes: int) -> ResultCache:
+    """The cache of a directory, shared by all rows and threads of a task"""
+    with caches_lock:
+        if cache_dir not in caches:
+            caches[cache_dir] = ResultCache(cache_dir, max_bytes)
+        return caches[cache_dir]
@@ -0,0 +1,53 @@
+import pytest
+from RunSparqlComunicaOperator.local_engine import construct_per_row, run_query
+
+ROWS = {
+    1: """<http://ex/place/1> a <http://ex/Place>; <http://ex/name> "Batavia"; <http://ex/country> "ID".""",
+    2: """<http://ex/place/2> a <http://ex/Place>; <http://ex/name> "Galle"@en.""",
+    3: """<http://ex/place/3> a <http://ex/Thing>; <http://ex/name> "Cochin".""",
+    # the same subject as row 1, which must not pick up row 1's triples
+    4: """<http://ex/place/1> a <http://ex/Place>; <http://ex/name> "Jakarta".""",
+}
+
+QUERIES = [
+    """PREFIX ex: <http://ex/>
+       CONSTRUCT { ?place a ex:Location; ex:label ?name; ex:in ?country }
+       WHERE { ?place a ex:Place; ex:name ?name OPTIONAL { ?place ex:country ?country } }""",
+    """CONSTRUCT { ?s <http://ex/label> ?name }
+       WHERE { ?s <http://ex/name> ?name FILTER(!langMatches(lang(?name), "en")) }""",
+    "CONSTRUCT WHERE { ?s <http://ex/name> ?name }",
+]
+
+
+@pytest.fixture
+def row_files(tmp_path):
+    files = {}
+    for row_number, turtle in ROWS.items():
+        files[row_number] = tmp_path / f"row_{row_number}.ttl"
+        files[row_number].write_text(turtle, encoding="utf-8")
+    return {row_number: [str(path)] for row_number, path in files.items()}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_batch_matches_per_row(row_files, query):
+    batch = construct_per_row(query, row_files)
+    assert batch == {row_number: run_query("rdflib", query, sources, "text/turtle")
+                     for row_number, sources in row_files.items()}
+
+
+def test_rows_without_matches_are_empty(row_files):
+    batch = construct_per_row("CONSTRUCT { ?s ?p ?o } WHERE { ?s a <http://ex/Thing>; ?p ?o }", row_files)
+    assert [row_number for row_number, output in batch.items() if output] == [3]
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * WHERE { ?s ?p ?o }",
+    "CONSTRUCT { ?s ?p ?o } WHERE { GRAPH ?g { ?s ?p ?o } }",
+    "CONSTRUCT { ?s ?p ?o } WHERE { { SELECT * WHERE { GRAPH ?g { ?s ?p ?o } } } }",
+    "CONSTRUCT { ?s ?p ?o } WHERE { SERVICE <http://ex/sparql> { ?s ?p ?o } }",
+    "CONSTRUCT { ?s ?p ?o } FROM <http://ex/graph> WHERE { ?s ?p ?o }",
+    "CONSTRUCT { ?s ?p ?o } FROM NAMED <http://ex/graph> WHERE { ?s ?p ?o }",
+])
+def test_queries_reaching_past_the_row_are_rejected(row_files, query):
+    with pytest.raises(ValueError):
+        construct_per_row(query, row_files)
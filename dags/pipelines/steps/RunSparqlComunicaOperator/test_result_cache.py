@@ -0,0 +1,77 @@
+import os
+import logging
+import uuid
+from RunSparqlComunicaOperator import RunSparqlComunicaOperator
+from RunSparqlComunicaOperator.result_cache import ResultCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path), 1000)
+    key = cache.key("SELECT", b"<a> <b> <c> .", "text/csv", "rdflib 7")
+    assert cache.get(key) is None
+    path = cache.put(key, "result")
+    assert cache.get(key) == path
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "result"
+
+
+def test_key_parts_do_not_run_into_each_other():
+    assert ResultCache.key("ab", "c") != ResultCache.key("a", "bc")
+
+
+def test_overwriting_a_key_counts_its_size_once(tmp_path):
+    cache = ResultCache(str(tmp_path), 1000)
+    for _ in range(5):
+        cache.put("k", "x" * 30)
+    assert cache.size == 30
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), 100)
+    for age, key in enumerate(("new", "used", "old")):
+        os.utime(cache.put(key, "x" * 30), (1000 - age, 1000 - age))
+    # reading marks "used" as the most recent one
+    cache.get("used")
+    cache.put("latest", "x" * 30)
+    assert [key for key in ("new", "used", "old", "latest") if cache.get(key)] == ["new", "used", "latest"]
+    assert cache.size <= 90
+
+
+def make_operator(tmp_path):
+    return RunSparqlComunicaOperator(
+        task_id=f"test_cache_{uuid.uuid4().hex}", docker_image="", docker_network="",
+        docker_rdf_file="file_uri:ttl", docker_output_format="text/turtle", output_trace="ttl", output_store="ttl",
+        query="file_uri:sparql", engine="rdflib", cache_dir=str(tmp_path / "cache"))
+
+
+class RowTI:
+    def __init__(self, xcoms):
+        self.xcoms = xcoms
+
+    def xcom_push(self, key, value=None, **kwargs):
+        self.xcoms[key] = value
+
+    def xcom_pull(self, task_ids=None, key="return_value", **kwargs):
+        return self.xcoms.get(key)
+
+
+def test_cache_hits_are_copied_and_counted(tmp_path, caplog):
+    row_ttl = tmp_path / "row.ttl"
+    row_ttl.write_text('<http://ex/a> <http://ex/name> "A".')
+    query_file = tmp_path / "row.sparql"
+    query_file.write_text("CONSTRUCT WHERE { ?s <http://ex/name> ?name }")
+    row = {"ttl": str(row_ttl), "sparql": str(query_file)}
+    operator = make_operator(tmp_path)
+
+    with caplog.at_level(logging.INFO):
+        first = operator.execute({"ti": RowTI({"previous_output": dict(row)})})
+    assert "0 hits, 1 misses" in caplog.text
+
+    # in a row of a CSVIteratorOperator, the hit goes to the row's counters
+    ti = RowTI({"previous_output": dict(row)})
+    second = operator.execute({"ti": ti, "row_number": 1})
+    assert ti.xcoms["stats"] == {"sparql_cache_hits": 1}
+    # a copy at the output path, not the cache file, which may be evicted
+    assert second["ttl"] == first["ttl"] and not second["ttl"].startswith(str(tmp_path / "cache"))
+    assert second["result"] == first["result"]
+    os.remove(first["ttl"])
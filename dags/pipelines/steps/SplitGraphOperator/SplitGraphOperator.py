@@ -4,7 +4,7 @@ import logging
 from pathlib import Path
 from rdflib import Graph, URIRef
 from airflow.models import BaseOperator
-from utils import get_step_names
+from utils import get_step_names, iter_message_queue
 
 
 class SplitGraphOperator(BaseOperator):
@@ -59,7 +59,7 @@ class SplitGraphOperator(BaseOperator):
         # Process each place
         counter = 0
         result = {}
-        for row in input_data:
+        for row in iter_message_queue(input_data):
             counter += 1
             self.logger.info(f"Processing place {counter}")
             self.logger.info(f"Task id: {self.task_id}: {json.dumps(row, indent=2)}")
@@ -1,6 +1,7 @@
 import logging
 import rdflib
 from airflow.models import BaseOperator
+from utils import iter_message_queue
 
 class TTLMergerOperator(BaseOperator):
     def __init__(self, message_queue, **kwargs):
@@ -13,7 +14,7 @@ class TTLMergerOperator(BaseOperator):
         if input_data:
             merged_ttl = rdflib.Graph()
             self.logger.debug(f"One input data received: {input_data}")
-            for result in input_data:
+            for result in iter_message_queue(input_data):
                 for k, v in result.items():
                     if k == "ttl":
                         try:
@@ -1,11 +1,10 @@
 import os
 import csv
 import logging
-import tempfile
 import shutil
 from airflow.models import BaseOperator
-from utils import get_step_names
-from saxonche import PySaxonProcessor
+from utils import get_input_csv_path, MessageQueue
+from . import xslt_cache
 
 class XSLTTransformationOperator(BaseOperator):
     def __init__(self, xslt_file: str = None,
@@ -13,6 +12,9 @@ class XSLTTransformationOperator(BaseOperator):
                  output_trace: str | None = None,
                  output_store: str | None = None,
                  xslt_params: dict | None = None,
+                 local_param_documents: bool = True,
+                 batch: bool = False,
+                 output_queue: str | None = None,
                  **kwargs):
         super().__init__(**kwargs)
         self.xslt_file = xslt_file
@@ -20,10 +22,73 @@ class XSLTTransformationOperator(BaseOperator):
         self.output_trace = output_trace
         self.output_store = output_store
         self.xslt_params = xslt_params
+        # pass remote XML documents in xslt_params as local copies, fetched once per run
+        self.local_param_documents = local_param_documents
+        # transform every row of the previous task's CSV in this task, instead of one row from previous_output
+        self.batch = batch
+        # message queue the batch results are appended to, in row order
+        self.output_queue = output_queue
         self.logger = logging.getLogger(__name__)
 
+    def transform(self, csv_path: str, sparql_output: str, run_id: str | None) -> str:
+        """Run the stylesheet on a CSV file"""
+        proc = xslt_cache.get_processor()
+        executable = xslt_cache.get_executable(self.xslt_file, run_id)
+        # setting calculated params
+        executable.set_parameter("csv", proc.make_string_value(f"file:{csv_path}"))
+        executable.set_parameter("out", proc.make_string_value(f"file:{sparql_output}"))
+        # setting xslt_params
+        self.logger.info(f"Setting params: {self.xslt_params}")
+        for k, v in (self.xslt_params or {}).items():
+            if self.local_param_documents and isinstance(v, str) and v.endswith(".xml"):
+                v = xslt_cache.get_local_copy(v, run_id)
+            self.logger.info(f"Setting param: {k}={v}")
+            executable.set_parameter(k, proc.make_string_value(v))
+        # setting resource file
+        fields_doc = xslt_cache.get_document(self.fields_file, run_id)
+        executable.set_global_context_item(xdm_item=fields_doc)
+        # run the transformation
+        res = executable.call_template_returning_string("main")
+
+        # a stylesheet may leave `out` unwritten, e.g. for a CSV without rows
+        if os.path.exists(sparql_output):
+            shutil.chown(sparql_output, user='airflow', group='root')
+            os.chmod(sparql_output, 0o777)
+        return res
+
+    def execute_batch(self, context):
+        """
+        Transform every row of the previous task's CSV in this one task, with the stylesheet compiled once.
+        Each row gets a one-row CSV as the per-row step does, and the results are appended to output_queue
+        in row order, as the per-row step would have returned them.
+        """
+        if not self.output_queue:
+            raise ValueError("Batch mode needs an output_queue for the per-row queries")
+        csv_path = get_input_csv_path(context, self.logger)
+        self.logger.info(f"Transforming all rows of {csv_path}")
+        queue = MessageQueue.for_run(self.output_queue, context["run_id"], truncate=True)
+        row_count = 0
+        with open(csv_path, "r", newline="", encoding="utf-8") as f:
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                name = f"{self.task_id}_row_{row_number}"
+                csv_output = f"/tmp/{name}.csv"
+                # written as JSONToCSVOperator writes a row
+                with open(csv_output, "w", newline="", encoding="utf-8") as row_csv:
+                    writer = csv.DictWriter(row_csv, fieldnames=row.keys())
+                    writer.writeheader()
+                    writer.writerow(row)
+                sparql_output = f"/tmp/{name}.{self.output_store}"
+                res = self.transform(csv_output, sparql_output, context.get("run_id"))
+                queue.append({"csv": csv_output, "sparql": sparql_output, "result": res})
+                row_count += 1
+        self.logger.info(f"Transformed {row_count} rows into message queue '{self.output_queue}'")
+        context["ti"].xcom_push(key=self.output_queue, value=queue.handle())
+        return {"rows": row_count, "message_queue": self.output_queue}
+
     def execute(self, context):
         self.logger.info(f"xslt_file: {self.xslt_file}; fields_file: {self.fields_file}")
+        if self.batch:
+            return self.execute_batch(context)
         csv_output = f"/tmp/{self.task_id}.csv"
         sparql_output = f"/tmp/{self.task_id}.{self.output_store}"
 
@@ -38,27 +103,7 @@ class XSLTTransformationOperator(BaseOperator):
                 csv_output = temp_csv.name
             self.logger.info(f"Temporary CSV file created at: {csv_output}")
 
-            with PySaxonProcessor(license=False) as proc:
-                xsltproc = proc.new_xslt30_processor()
-                xslt_doc = proc.parse_xml(xml_uri=self.xslt_file)
-                xsltproc.set_cwd(os.getcwd())
-                executable = xsltproc.compile_stylesheet(stylesheet_node=xslt_doc)
-                # setting calculated params
-                executable.set_parameter("csv", proc.make_string_value(f"file:{csv_output}"))
-                executable.set_parameter("out", proc.make_string_value(f"file:{sparql_output}"))
-                # setting xslt_params
-                self.logger.info(f"Setting params: {self.xslt_params}")
-                for k, v in (self.xslt_params or {}).items():
-                    self.logger.info(f"Setting param: {k}={v}")
-                    executable.set_parameter(k, proc.make_string_value(v))
-                # setting resource file
-                fields_doc = proc.parse_xml(xml_uri=self.fields_file)
-                executable.set_global_context_item(xdm_item=fields_doc)
-                # run the transformation
-                res = executable.call_template_returning_string("main")
-
-            shutil.chown(sparql_output, user='airflow', group='root')
-            os.chmod(sparql_output, 0o777)
+            res = self.transform(csv_output, sparql_output, context.get("run_id"))
             result = {"csv": csv_output, "sparql": sparql_output, "result": res}
             context["ti"].xcom_push("previous_output", result)
             return result
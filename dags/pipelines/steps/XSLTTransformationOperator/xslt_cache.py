@@ -0,0 +1,101 @@
+import os
+import hashlib
+import logging
+import threading
+import urllib.request
+from urllib.parse import urlparse
+from saxonche import PySaxonProcessor
+
+logger = logging.getLogger(__name__)
+
+# Process-level cache of the Saxon processor, the compiled stylesheets and the parsed context documents,
+# so a row only pays for its transformation. Resources are fetched once per DAG run and the compiled
+# objects are keyed by URI and content hash, so a changed stylesheet is compiled again by the next run.
+lock = threading.RLock()
+processor: PySaxonProcessor | None = None
+resources: dict = {}  # uri -> (run_id, content hash, content)
+executables: dict = {}  # (uri, content hash) -> XsltExecutable
+documents: dict = {}  # (uri, content hash) -> XdmNode
+local_copies: dict = {}  # (uri, content hash) -> file URI
+
+
+def to_uri(location: str) -> str:
+    if urlparse(location).scheme in ("http", "https", "file"):
+        return location
+    return f"file:{os.path.abspath(location)}"
+
+
+def get_processor() -> PySaxonProcessor:
+    global processor
+    with lock:
+        if processor is None:
+            processor = PySaxonProcessor(license=False)
+        return processor
+
+
+def fetch(location: str, run_id: str | None) -> tuple[str, bytes]:
+    """Content hash and content of a resource, read once per DAG run"""
+    with lock:
+        cached = resources.get(location)
+        if cached and cached[0] == run_id:
+            return cached[1], cached[2]
+        uri = to_uri(location)
+        if uri.startswith("file:"):
+            with open(urlparse(uri).path, "rb") as f:
+                content = f.read()
+        else:
+            with urllib.request.urlopen(uri, timeout=60) as response:
+                content = response.read()
+        digest = hashlib.sha256(content).hexdigest()
+        resources[location] = (run_id, digest, content)
+        return digest, content
+
+
+def get_executable(xslt_file: str, run_id: str | None):
+    """A copy of the compiled stylesheet, to set the parameters of one transformation on"""
+    with lock:
+        digest, content = fetch(xslt_file, run_id)
+        executable = executables.get((xslt_file, digest))
+        if executable is None:
+            proc = get_processor()
+            builder = proc.new_document_builder()
+            # includes and imports are resolved against the stylesheet URI
+            builder.set_base_uri(to_uri(xslt_file))
+            xslt_doc = builder.parse_xml(xml_text=content.decode("utf-8"))
+            xsltproc = proc.new_xslt30_processor()
+            xsltproc.set_cwd(os.getcwd())
+            executable = xsltproc.compile_stylesheet(stylesheet_node=xslt_doc)
+            executables[(xslt_file, digest)] = executable
+            logger.info(f"Compiled stylesheet {xslt_file} ({digest[:12]})")
+        return executable.clone()
+
+
+def get_document(xml_file: str, run_id: str | None):
+    with lock:
+        digest, content = fetch(xml_file, run_id)
+        document = documents.get((xml_file, digest))
+        if document is None:
+            builder = get_processor().new_document_builder()
+            builder.set_base_uri(to_uri(xml_file))
+            document = builder.parse_xml(xml_text=content.decode("utf-8"))
+            documents[(xml_file, digest)] = document
+            logger.info(f"Parsed document {xml_file} ({digest[:12]})")
+        return document
+
+
+def get_local_copy(location: str, run_id: str | None, cache_dir: str = "/tmp/xslt_cache") -> str:
+    """File URI of a local copy of a remote document, so the stylesheet does not fetch it in every row"""
+    if urlparse(location).scheme not in ("http", "https"):
+        return location
+    with lock:
+        digest, content = fetch(location, run_id)
+        uri = local_copies.get((location, digest))
+        if uri is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, f"{digest}{os.path.splitext(urlparse(location).path)[1]}")
+            # written aside and moved, another process may be reading the same copy
+            with open(f"{path}.{os.getpid()}", "wb") as f:
+                f.write(content)
+            os.replace(f"{path}.{os.getpid()}", path)
+            uri = local_copies[(location, digest)] = f"file:{path}"
+        return uri
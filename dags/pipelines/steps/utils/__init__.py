@@ -1 +1,2 @@
-from .utils import get_step_names
\ No newline at end of file
+from .utils import get_step_names, get_input_csv_path
+from .message_queue import MessageQueue, iter_message_queue
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import shutil
+import logging
+from typing import Iterator, Iterable, Any
+
+logger = logging.getLogger(__name__)
+
+
+class MessageQueue:
+    """
+    Append-only JSON lines log of the items collected for a message queue in one DAG run.
+    Appending is O(1) and only a small handle goes to XCom; readers iterate the items lazily.
+    A queue may span several files, e.g. one per shard, which are read in order.
+    The logs of runs not written to for max_age_days are removed when the next run creates its first queue.
+    """
+
+    def __init__(self, name: str, paths: list[str]):
+        self.name = name
+        self.paths = paths
+
+    @classmethod
+    def for_run(cls, name: str, run_id: str, suffix: str = "", queue_dir: str = "/tmp/message_queues",
+                truncate: bool = False, max_age_days: float = 7) -> "MessageQueue":
+        run_dir = os.path.join(queue_dir, str(run_id).replace(":", "_").replace("/", "_"))
+        if not os.path.isdir(run_dir):
+            # the first queue of a run clears out those of old runs, which later tasks may still read until then
+            prune_runs(queue_dir, max_age_days)
+        os.makedirs(run_dir, exist_ok=True)
+        path = os.path.join(run_dir, f"{name}{suffix}.jsonl")
+        if truncate:
+            open(path, "w").close()
+        return cls(name, [path])
+
+    @classmethod
+    def from_handle(cls, handle: dict) -> "MessageQueue":
+        return cls(handle["message_queue"], list(handle["paths"]))
+
+    @staticmethod
+    def is_handle(value: Any) -> bool:
+        return isinstance(value, dict) and "message_queue" in value and "paths" in value
+
+    def handle(self) -> dict:
+        return {"message_queue": self.name, "paths": self.paths}
+
+    def extend(self, items: Iterable) -> None:
+        """Append items to the last file of the queue"""
+        with open(self.paths[-1], "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(item) + "\n" for item in items)
+
+    def append(self, item) -> None:
+        self.extend([item])
+
+    def __iter__(self) -> Iterator:
+        for path in self.paths:
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+
+
+def prune_runs(queue_dir: str, max_age_days: float) -> None:
+    """Remove the queues of runs that were last written more than max_age_days ago"""
+    if not os.path.isdir(queue_dir):
+        return
+    cutoff = time.time() - max_age_days * 86400
+    for entry in os.scandir(queue_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            last_written = max([entry.stat().st_mtime] + [item.stat().st_mtime for item in os.scandir(entry.path)])
+        except FileNotFoundError:
+            # removed by another task pruning at the same time
+            continue
+        if last_written < cutoff:
+            logger.info(f"Removing message queues of {entry.name}, last written {max_age_days} or more days ago")
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def iter_message_queue(value) -> Iterator:
+    """Items of a message queue pulled from XCom: a MessageQueue handle, or a list as pushed before"""
+    if MessageQueue.is_handle(value):
+        return iter(MessageQueue.from_handle(value))
+    return iter(value or [])
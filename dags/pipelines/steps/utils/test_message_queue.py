@@ -0,0 +1,56 @@
+import os
+import json
+import time
+from utils.message_queue import MessageQueue, iter_message_queue
+
+ITEMS = [{"ttl": "/tmp/row_1.ttl", "row": {"id": "1"}}, {"ttl": "/tmp/row_2.ttl", "row": {"id": "ä, \"2\"\n"}}]
+
+
+def test_items_round_trip_through_the_handle(tmp_path):
+    queue = MessageQueue.for_run("all_the_rows", "manual__2024-01-01T00:00:00+00:00", queue_dir=str(tmp_path))
+    queue.append(ITEMS[0])
+    queue.extend(ITEMS[1:])
+    # XCom stores the handle as JSON
+    handle = json.loads(json.dumps(queue.handle()))
+    assert MessageQueue.is_handle(handle)
+    assert list(iter_message_queue(handle)) == ITEMS
+    # run IDs are turned into a single directory name
+    assert os.listdir(tmp_path) == ["manual__2024-01-01T00_00_00+00_00"]
+
+
+def test_shard_logs_are_read_in_order(tmp_path):
+    shards = [MessageQueue.for_run("all_the_rows", "run", f"_{first_row}", queue_dir=str(tmp_path))
+              for first_row in (1, 3)]
+    shards[1].extend([{"row_number": 3}, {"row_number": 4}])
+    shards[0].extend([{"row_number": 1}, {"row_number": 2}])
+    queue = MessageQueue("all_the_rows", shards[0].paths + shards[1].paths)
+    assert [item["row_number"] for item in queue] == [1, 2, 3, 4]
+
+
+def test_truncate_empties_the_log_of_a_retried_task(tmp_path):
+    MessageQueue.for_run("ttl_rows", "run", queue_dir=str(tmp_path)).extend(ITEMS)
+    queue = MessageQueue.for_run("ttl_rows", "run", queue_dir=str(tmp_path), truncate=True)
+    queue.extend(ITEMS[:1])
+    assert list(queue) == ITEMS[:1]
+
+
+def test_lists_pushed_before_are_still_read():
+    assert list(iter_message_queue(ITEMS)) == ITEMS
+    assert list(iter_message_queue(None)) == []
+
+
+def test_new_run_prunes_old_runs(tmp_path):
+    old = MessageQueue.for_run("all_the_rows", "old_run", queue_dir=str(tmp_path))
+    old.extend(ITEMS)
+    recent = MessageQueue.for_run("all_the_rows", "recent_run", queue_dir=str(tmp_path))
+    recent.extend(ITEMS)
+    eight_days_ago = time.time() - 8 * 86400
+    for path in (old.paths[0], os.path.dirname(old.paths[0]), os.path.dirname(recent.paths[0])):
+        os.utime(path, (eight_days_ago, eight_days_ago))
+
+    # a queue added to a run that exists does not prune
+    MessageQueue.for_run("ttl_rows", "recent_run", queue_dir=str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["old_run", "recent_run"]
+    MessageQueue.for_run("all_the_rows", "new_run", queue_dir=str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["new_run", "recent_run"]
+    assert list(recent) == ITEMS
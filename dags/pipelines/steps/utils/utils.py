@@ -1,7 +1,31 @@
+import os.path
+import logging
+
+
 def get_step_names(context):
     current_step = context['task']
     previous_steps = [task for task in context['task'].upstream_list]
     return {
         "current_step": current_step,
         "previous_steps": previous_steps
-    }
\ No newline at end of file
+    }
+
+
+def get_input_csv_path(context, logger: logging.Logger) -> str:
+    """Path of the CSV file the previous task stored under its `output_store` key"""
+    step_names = get_step_names(context)
+    previous_task = step_names["previous_steps"][-1] if step_names["previous_steps"] else None
+    if previous_task:
+        logger.info(f"Previous task ID: {previous_task.task_id}")
+        previous_task_xcom_data = context['ti'].xcom_pull(task_ids=previous_task.task_id)
+        logger.debug(f"XCom data from previous task: {previous_task_xcom_data}")
+    else:
+        raise Exception("No previous task found, starting from the beginning.")
+
+    if previous_task.output_store in previous_task_xcom_data.keys():
+        logger.info(f"Loaded CSV data from file path in '{previous_task.output_store}'.")
+        csv_data_path = previous_task_xcom_data.get(previous_task.output_store, None)
+        if not csv_data_path or not isinstance(csv_data_path, str) or not os.path.isfile(csv_data_path):
+            raise ValueError(f"No file path found in XCom with key: {previous_task.output_store}")
+        return csv_data_path
+    raise Exception(f"Neither 'result' nor '{previous_task.output_store}' found in XCom data from previous task.")